@@ -0,0 +1,214 @@
+# Offline bulk processing through the Azure OpenAI Batch API. Input rows are
+# streamed from a JSONL file into Batch API request files of bounded size,
+# each file is uploaded and submitted as its own batch, and the output files
+# are streamed back and joined to the input ids. Memory stays flat whatever
+# the input size, and progress is checkpointed after every step so a
+# restarted job resumes where it stopped.
+import os
+import json
+import shutil
+import itertools
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+TERMINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+MAX_FILE_BYTES = 190 * 1024 * 1024  # Batch input files are limited to 200MB
+
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "azure-responses-batch")
+
+
+def data_dir() -> str:
+    return os.path.realpath(os.environ.get("BATCH_DATA_DIR", DEFAULT_DATA_DIR))
+
+
+def resolve_data_path(path: str) -> str:
+    # Input and output files must live under BATCH_DATA_DIR; relative paths are
+    # taken from there and symlinks are resolved before the check
+    base = data_dir()
+    resolved = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, resolved]) != base or resolved == base:
+        raise ValueError(f"Path must be inside the batch data directory: {path}")
+    return resolved
+
+
+def batch_url() -> str:
+    return os.environ.get("AZURE_OPENAI_BATCH_URL", "/v1/responses")
+
+
+def request_body(row: Dict[str, Any], model: str, json_schema: Optional[Dict[str, Any]],
+                 system_prompt: Optional[str]) -> Dict[str, Any]:
+    # A row carries either a plain prompt or a list of input messages
+    messages = row["input"] if "input" in row else [{"role": "user", "content": row["prompt"]}]
+    if system_prompt:
+        messages = [{"role": "system", "content": system_prompt}] + list(messages)
+    body: Dict[str, Any] = {"model": model, "input": messages}
+    if json_schema:
+        body["text"] = {
+            "format": {
+                "type": "json_schema",
+                "name": "structured_data",
+                "schema": json_schema,
+                "strict": True
+            }
+        }
+    return body
+
+
+def read_rows(input_path: str, skip_rows: int = 0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    # Yields (custom_id, row) for each non-empty input line after skip_rows
+    with open(input_path) as source:
+        line_number = 0
+        for line in source:
+            if not line.strip():
+                continue
+            line_number += 1
+            if line_number <= skip_rows:
+                continue
+            row = json.loads(line)
+            yield str(row.get("id", line_number)), row
+
+
+def write_parts(input_path: str, work_dir: str, skip_rows: int, rows_per_file: int,
+                build_body: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Iterator[Tuple[str, int]]:
+    # Yields (path, rows) for each Batch API input file, one at a time
+    part, rows, size = None, 0, 0
+    for custom_id, row in read_rows(input_path, skip_rows):
+        request = json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": batch_url(),
+            "body": build_body(row)
+        }) + "\n"
+        if part is not None and (rows >= rows_per_file or size + len(request) > MAX_FILE_BYTES):
+            part.close()
+            yield part.name, rows
+            part = None
+        if part is None:
+            part = tempfile.NamedTemporaryFile("w", suffix=".jsonl", dir=work_dir, delete=False)
+            rows, size = 0, 0
+        part.write(request)
+        rows += 1
+        size += len(request)
+    if part is not None:
+        part.close()
+        yield part.name, rows
+
+
+def output_text(body: Dict[str, Any]) -> str:
+    texts = []
+    for item in body.get("output", []):
+        for content in item.get("content", []) or []:
+            if content.get("type") == "output_text":
+                texts.append(content["text"])
+    return "".join(texts)
+
+
+def join_output(client, file_id: str, destination, structured: bool, seen: Set[str]) -> Tuple[int, int, int, int]:
+    # Streams a batch output or error file and writes one result line per id;
+    # returns (succeeded, failed, input_tokens, output_tokens)
+    succeeded = failed = input_tokens = output_tokens = 0
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            result: Dict[str, Any] = {"id": record["custom_id"]}
+            seen.add(record["custom_id"])
+            response_body = (record.get("response") or {}).get("body") or {}
+            status_code = (record.get("response") or {}).get("status_code")
+            usage = response_body.get("usage") or {}
+            input_tokens += usage.get("input_tokens", usage.get("prompt_tokens", 0))
+            output_tokens += usage.get("output_tokens", usage.get("completion_tokens", 0))
+            if record.get("error") or status_code != 200:
+                result["error"] = record.get("error") or response_body.get("error") or {"status_code": status_code}
+                failed += 1
+            else:
+                text = output_text(response_body)
+                try:
+                    result["response"] = json.loads(text) if structured else text
+                    succeeded += 1
+                except ValueError:
+                    result["error"] = {"message": "Output is not valid JSON", "output": text}
+                    failed += 1
+            destination.write(json.dumps(result) + "\n")
+    return succeeded, failed, input_tokens, output_tokens
+
+
+def run_batch_offline(client, job, input_path: str, output_path: str, model: str,
+                      json_schema: Optional[Dict[str, Any]] = None, system_prompt: Optional[str] = None,
+                      rows_per_file: int = 50000, poll_interval: float = 30.0) -> Dict[str, Any]:
+    checkpoint = dict(job.checkpoint) if job.checkpoint else {"rows_submitted": 0, "parts": []}
+    parts: List[Dict[str, Any]] = checkpoint["parts"]
+    work_dir = output_path + ".parts"
+    os.makedirs(work_dir, exist_ok=True)
+
+    # Split, upload and submit; each file is deleted locally once submitted
+    def build_body(row: Dict[str, Any]) -> Dict[str, Any]:
+        return request_body(row, model, json_schema, system_prompt)
+
+    for path, rows in write_parts(input_path, work_dir, checkpoint["rows_submitted"], rows_per_file, build_body):
+        with open(path, "rb") as file:
+            input_file = client.files.create(file=file, purpose="batch")
+        os.remove(path)
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=batch_url(),
+            completion_window="24h"
+        )
+        parts.append({"batch_id": batch.id, "input_file_id": input_file.id, "rows": rows,
+                      "first_row": checkpoint["rows_submitted"], "status": batch.status, "joined": False})
+        checkpoint["rows_submitted"] += rows
+        job.save_checkpoint(checkpoint)
+
+    # Poll until every batch is finished, joining outputs as they complete
+    while not all(part["joined"] for part in parts):
+        for index, part in enumerate(parts):
+            if part["joined"]:
+                continue
+            batch = client.batches.retrieve(part["batch_id"])
+            part["status"] = batch.status
+            if batch.status not in TERMINAL_BATCH_STATUSES:
+                continue
+            part_path = os.path.join(work_dir, f"output-{index:05d}.jsonl")
+            counts = [0, 0, 0, 0]
+            seen: Set[str] = set()
+            with open(part_path, "w") as destination:
+                for file_id in (batch.output_file_id, batch.error_file_id):
+                    if file_id:
+                        for i, count in enumerate(join_output(client, file_id, destination, json_schema is not None, seen)):
+                            counts[i] += count
+                # A failed, expired or cancelled batch may return only some
+                # rows, or none; the rest are reported as errors
+                missing = part["rows"] - counts[0] - counts[1]
+                if missing > 0 and "first_row" in part:
+                    error = {"message": f"No result returned, batch {batch.status}"}
+                    for custom_id, _ in itertools.islice(read_rows(input_path, part["first_row"]), part["rows"]):
+                        if custom_id not in seen:
+                            destination.write(json.dumps({"id": custom_id, "error": error}) + "\n")
+                    counts[1] += missing
+            part.update(joined=True, succeeded=counts[0], failed=counts[1],
+                        input_tokens=counts[2], output_tokens=counts[3])
+            job.save_checkpoint(checkpoint)
+        if not all(part["joined"] for part in parts):
+            job.wait(poll_interval)
+
+    # Concatenate the per-batch results in submission order
+    with open(output_path, "w") as output:
+        for index in range(len(parts)):
+            part_path = os.path.join(work_dir, f"output-{index:05d}.jsonl")
+            with open(part_path) as source:
+                shutil.copyfileobj(source, output)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "output_path": output_path,
+        "rows": checkpoint["rows_submitted"],
+        "succeeded": sum(part.get("succeeded", 0) for part in parts),
+        "failed": sum(part.get("failed", 0) for part in parts),
+        "usage": {
+            "input_tokens": sum(part.get("input_tokens", 0) for part in parts),
+            "output_tokens": sum(part.get("output_tokens", 0) for part in parts)
+        },
+        "batches": [{"batch_id": part["batch_id"], "status": part["status"], "rows": part["rows"]} for part in parts]
+    }
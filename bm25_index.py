@@ -0,0 +1,310 @@
+# Local BM25 index over ingested documents. Documents are split into passages
+# with the ingestion chunker and indexed in immutable segments; each segment
+# stores its postings, document lengths and passage offsets as flat uint32 /
+# uint64 arrays that are memory-mapped at query time. Re-indexing a changed
+# file appends a new segment and tombstones the file's old passages, and
+# small segments are merged once there are too many of them.
+import os
+import re
+import json
+import math
+import mmap
+import time
+import heapq
+import shutil
+import hashlib
+import tempfile
+import threading
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from ingestion import chunk_text, read_text
+from shared_state import SharedStore, transaction
+
+TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+MAX_SEGMENTS = 8
+K1 = 1.2
+B = 0.75
+
+manifests = SharedStore("local_index")
+
+
+def index_root() -> str:
+    return os.environ.get("LOCAL_INDEX_DIR", os.path.join(tempfile.gettempdir(), "azure-responses-index"))
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_segment(directory: str, passages: List[Tuple[str, str]]):
+    # passages are (source, text); doc ids are positions in this list
+    os.makedirs(directory)
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    lengths = array("I")
+    for doc_id, (_, text) in enumerate(passages):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings[term].append((doc_id, tf))
+
+    lexicon = {}
+    flat = array("I")
+    for term in sorted(postings):
+        lexicon[term] = [len(flat) // 2, len(postings[term])]
+        for doc_id, tf in postings[term]:
+            flat.extend((doc_id, tf))
+
+    offsets = array("Q")
+    with open(os.path.join(directory, "passages.jsonl"), "wb") as file:
+        for source, text in passages:
+            offsets.append(file.tell())
+            file.write(json.dumps({"source": source, "text": text}).encode("utf-8") + b"\n")
+        offsets.append(file.tell())
+
+    for name, values in (("postings.bin", flat), ("lengths.bin", lengths), ("offsets.bin", offsets)):
+        with open(os.path.join(directory, name), "wb") as file:
+            values.tofile(file)
+    with open(os.path.join(directory, "lexicon.json"), "w") as file:
+        json.dump({"docs": len(passages), "total_length": sum(lengths), "terms": lexicon}, file)
+
+
+class Segment:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "lexicon.json")) as file:
+            meta = json.load(file)
+        self.docs = meta["docs"]
+        self.total_length = meta["total_length"]
+        self.terms = meta["terms"]
+        self._maps = []
+        self.postings = self._map("postings.bin", "I")
+        self.lengths = self._map("lengths.bin", "I")
+        self.offsets = self._map("offsets.bin", "Q")
+        self._passages = self._map("passages.jsonl", None)
+
+    def _map(self, name: str, typecode: Optional[str]):
+        with open(os.path.join(self.directory, name), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return memoryview(b"").cast(typecode) if typecode else b""
+            view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(view)
+        return memoryview(view).cast(typecode) if typecode else view
+
+    def passage(self, doc_id: int) -> Dict[str, Any]:
+        return json.loads(self._passages[self.offsets[doc_id]:self.offsets[doc_id + 1]])
+
+    def close(self):
+        for view in (self.postings, self.lengths, self.offsets):
+            if isinstance(view, memoryview):
+                view.release()
+        for view in self._maps:
+            view.close()
+
+
+class LocalIndex:
+    def __init__(self, name: str):
+        self.name = name
+        self.directory = os.path.join(index_root(), name)
+        self.lock = threading.Lock()
+        self.loaded_version = None
+        self.segments: Dict[str, Segment] = {}
+        self.deleted: Dict[str, set] = {}
+
+    def manifest(self) -> Dict[str, Any]:
+        return manifests.get(self.name) or {"version": 0, "segments": [], "sources": {}, "deleted": {}}
+
+    def _load(self):
+        # Reopen segments when another worker or call changed the manifest
+        manifest = self.manifest()
+        if manifest["version"] == self.loaded_version:
+            return manifest
+        for segment_name in list(self.segments):
+            if segment_name not in manifest["segments"]:
+                self.segments.pop(segment_name).close()
+        for segment_name in manifest["segments"]:
+            if segment_name not in self.segments:
+                self.segments[segment_name] = Segment(os.path.join(self.directory, segment_name))
+        self.deleted = {segment: set(doc_ids) for segment, doc_ids in manifest["deleted"].items()}
+        self.loaded_version = manifest["version"]
+        return manifest
+
+    def add_files(self, file_paths: List[str], passage_tokens: int = 200, overlap_tokens: int = 40) -> Dict[str, Any]:
+        started = time.perf_counter()
+        known = self.manifest()["sources"]
+        passages: List[Tuple[str, str]] = []
+        changed: Dict[str, Dict[str, Any]] = {}
+        touched: Dict[str, Dict[str, int]] = {}
+        unreadable: Dict[str, Dict[str, Any]] = {}
+        skipped = 0
+        for path in file_paths:
+            source = os.path.abspath(path)
+            stat = os.stat(source)
+            entry = known.get(source, {})
+            # Only files whose size or mtime changed are hashed
+            if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                skipped += 1
+                continue
+            digest = _file_digest(source)
+            if entry.get("sha256") == digest:
+                touched[source] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+                skipped += 1
+                continue
+            text = read_text(source)
+            if text is None:
+                # Stamped without passages so it is not re-hashed, and its old passages go
+                unreadable[source] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                      "segment": None, "start": 0, "count": 0}
+                continue
+            chunks = chunk_text(text, passage_tokens, overlap_tokens)
+            changed[source] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                               "start": len(passages), "count": len(chunks)}
+            passages.extend((source, chunk) for chunk in chunks)
+
+        if touched and not passages and not unreadable:
+            # Same content under a new mtime; remember it so the next call skips the hash
+            with transaction():
+                manifest = self.manifest()
+                for source, stamp in touched.items():
+                    if source in manifest["sources"]:
+                        manifest["sources"][source].update(stamp)
+                manifests[self.name] = manifest
+
+        if passages or unreadable:
+            segment_name = f"seg-{time.time_ns():x}-{os.getpid()}"
+            if passages:
+                write_segment(os.path.join(self.directory, segment_name), passages)
+            with transaction():
+                manifest = self.manifest()
+                for source, entry in changed.items():
+                    self._tombstone(manifest, source)
+                    manifest["sources"][source] = {"segment": segment_name, **entry}
+                for source, entry in unreadable.items():
+                    self._tombstone(manifest, source)
+                    manifest["sources"][source] = entry
+                for source, stamp in touched.items():
+                    if source in manifest["sources"]:
+                        manifest["sources"][source].update(stamp)
+                if passages:
+                    manifest["segments"].append(segment_name)
+                manifest["version"] += 1
+                manifests[self.name] = manifest
+            if len(manifest["segments"]) > MAX_SEGMENTS:
+                self.compact()
+
+        return {
+            "index": self.name,
+            "indexed_files": len(changed),
+            "unchanged_files": skipped,
+            "unreadable_files": len(unreadable),
+            "passages": len(passages),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    def _tombstone(self, manifest: Dict[str, Any], source: str):
+        old = manifest["sources"].get(source)
+        if old and old["segment"] is not None:
+            deleted = manifest["deleted"].setdefault(old["segment"], [])
+            deleted.extend(range(old["start"], old["start"] + old["count"]))
+
+    def compact(self):
+        # Merge all segments into one, dropping tombstoned passages
+        with self.lock:
+            manifest = self._load()
+            passages: List[Tuple[str, str]] = []
+            sources: Dict[str, Dict[str, Any]] = {}
+            for source, entry in manifest["sources"].items():
+                if entry["segment"] is None:
+                    sources[source] = entry
+                    continue
+                segment = self.segments[entry["segment"]]
+                sources[source] = {**entry, "start": len(passages)}
+                for doc_id in range(entry["start"], entry["start"] + entry["count"]):
+                    passages.append((source, segment.passage(doc_id)["text"]))
+            segment_name = f"seg-{time.time_ns():x}-{os.getpid()}"
+            write_segment(os.path.join(self.directory, segment_name), passages)
+            with transaction():
+                current = self.manifest()
+                if current["version"] != manifest["version"]:
+                    # Another writer got in first; keep its state and retry later
+                    shutil.rmtree(os.path.join(self.directory, segment_name), ignore_errors=True)
+                    return
+                for entry in sources.values():
+                    if entry["segment"] is not None:
+                        entry["segment"] = segment_name
+                manifests[self.name] = {
+                    "version": current["version"] + 1,
+                    "segments": [segment_name],
+                    "sources": sources,
+                    "deleted": {}
+                }
+            self._load()
+            for old_name in manifest["segments"]:
+                shutil.rmtree(os.path.join(self.directory, old_name), ignore_errors=True)
+
+    def search(self, query: str, top_k: int = 8, sources: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        with self.lock:
+            self._load()
+            segments = list(self.segments.items())
+            live_docs = sum(segment.docs - len(self.deleted.get(name, ())) for name, segment in segments)
+            total_length = sum(segment.total_length for _, segment in segments)
+            if not live_docs:
+                return []
+            average_length = total_length / sum(segment.docs for _, segment in segments)
+            allowed = {os.path.abspath(path) for path in sources} if sources else None
+
+            terms = set(tokenize(query))
+            document_frequency = {
+                term: sum(segment.terms[term][1] for _, segment in segments if term in segment.terms)
+                for term in terms
+            }
+
+            scores: Dict[Tuple[str, int], float] = defaultdict(float)
+            for name, segment in segments:
+                deleted = self.deleted.get(name, ())
+                for term in terms:
+                    if term not in segment.terms:
+                        continue
+                    df = document_frequency[term]
+                    idf = math.log(1 + (live_docs - df + 0.5) / (df + 0.5))
+                    offset, count = segment.terms[term]
+                    for i in range(offset * 2, (offset + count) * 2, 2):
+                        doc_id, tf = segment.postings[i], segment.postings[i + 1]
+                        if doc_id in deleted:
+                            continue
+                        norm = K1 * (1 - B + B * segment.lengths[doc_id] / average_length)
+                        scores[(name, doc_id)] += idf * tf * (K1 + 1) / (tf + norm)
+
+            # Only a source filter needs to look past the first top_k hits
+            limit = top_k if allowed is None else len(scores)
+            results = []
+            for (name, doc_id), score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1]):
+                passage = self.segments[name].passage(doc_id)
+                if allowed is not None and passage["source"] not in allowed:
+                    continue
+                results.append({"score": round(score, 4), **passage})
+                if len(results) >= top_k:
+                    break
+            return results
+
+
+_indexes: Dict[str, LocalIndex] = {}
+
+
+def get_index(name: str) -> LocalIndex:
+    if not re.fullmatch(r"[\w-]+", name):
+        raise ValueError("Index names may only contain letters, digits, '-' and '_'")
+    if name not in _indexes:
+        _indexes[name] = LocalIndex(name)
+    return _indexes[name]
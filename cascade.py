@@ -0,0 +1,179 @@
+# Complexity-based model cascade. A cheap local classifier scores each request
+# from its input length, prompt heuristics, route and (for structured output)
+# schema size; requests scoring under the threshold go to the small deployment
+# and the rest to the large one. Structured output from the small model that
+# fails schema validation is retried on the large model by the caller.
+import re
+from typing import Any, Dict, Optional, Tuple
+from hedging import LatencyTracker
+
+try:
+    import jsonschema
+except ImportError:  # jsonschema is optional
+    jsonschema = None
+
+TIERS = ("small", "large")
+
+HARD_PROMPT = re.compile(
+    r"\b(prove|derive|step[- ]by[- ]step|analy[sz]e|compare|trade-?offs?|debug|refactor|implement|"
+    r"architecture|optimi[sz]e|explain why|justify|evaluate|critique|plan)\b",
+    re.IGNORECASE
+)
+CODE = re.compile(r"```|^\s*(def|class|function|import|SELECT|#include)\b", re.MULTILINE)
+
+# Per-route score offsets; image understanding always goes to the large model
+DEFAULT_ROUTE_SCORES = {"image": 10.0, "image-url": 10.0}
+
+# USD per million tokens, used only for the cost estimate in the stats
+DEFAULT_PRICES = {
+    "small": {"input": 0.15, "output": 0.60},
+    "large": {"input": 2.50, "output": 10.00},
+}
+
+
+def _text_of(value: Any) -> str:
+    # Concatenated text of a prompt or message list, without image data
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n".join(_text_of(item) for item in value)
+    if isinstance(value, dict):
+        if value.get("type") in ("input_image", "image_url"):
+            return ""
+        return _text_of(value.get("content", value.get("text", "")))
+    return ""
+
+
+def _schema_size(schema: Any, depth: int = 1) -> Tuple[int, int]:
+    # (number of properties, maximum nesting depth)
+    if not isinstance(schema, dict):
+        return 0, depth
+    properties = schema.get("properties", {})
+    count, deepest = len(properties), depth
+    children = list(properties.values())
+    if isinstance(schema.get("items"), dict):
+        children.append(schema["items"])
+    children.extend(schema.get("$defs", {}).values())
+    for child in children:
+        child_count, child_depth = _schema_size(child, depth + 1)
+        count += child_count
+        deepest = max(deepest, child_depth)
+    return count, deepest
+
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "boolean": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+}
+
+
+def _matches(value: Any, schema: Dict[str, Any]) -> bool:
+    # Covers the subset of JSON Schema that strict structured outputs allow
+    if "$ref" in schema:
+        return True
+    if "anyOf" in schema:
+        return any(_matches(value, option) for option in schema["anyOf"])
+    if "enum" in schema and value not in schema["enum"]:
+        return False
+    types = schema.get("type")
+    types = types if isinstance(types, list) else [types] if types else []
+    if types and not any(_TYPE_CHECKS.get(name, lambda _: True)(value) for name in types):
+        return False
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        if any(name not in value for name in schema.get("required", [])):
+            return False
+        if schema.get("additionalProperties") is False and any(name not in properties for name in value):
+            return False
+        return all(_matches(item, properties[name]) for name, item in value.items() if name in properties)
+    if isinstance(value, list) and isinstance(schema.get("items"), dict):
+        return all(_matches(item, schema["items"]) for item in value)
+    return True
+
+
+def validate(value: Any, schema: Dict[str, Any]) -> bool:
+    if jsonschema is not None:
+        try:
+            jsonschema.validate(value, schema)
+            return True
+        except jsonschema.ValidationError:
+            return False
+    return _matches(value, schema)
+
+
+class CascadeRouter:
+    def __init__(self, small_model: str, large_model: str, metrics, threshold: float = 1.0,
+                 route_scores: Optional[Dict[str, float]] = None, prices: Optional[Dict[str, Dict[str, float]]] = None):
+        self.models = {"small": small_model, "large": large_model}
+        self.metrics = metrics
+        self.threshold = threshold
+        self.route_scores = {**DEFAULT_ROUTE_SCORES, **(route_scores or {})}
+        self.prices = {**DEFAULT_PRICES, **(prices or {})}
+        self.latency = LatencyTracker()
+
+    def score(self, route: str, kwargs: Dict[str, Any]) -> float:
+        text = _text_of(kwargs.get("input", ""))
+        score = self.route_scores.get(route, 0.0)
+        score += len(text) / 4000  # roughly 1 point per thousand tokens
+        score += min(len(HARD_PROMPT.findall(text)), 3) * 0.5
+        if CODE.search(text):
+            score += 1.0
+        if isinstance(kwargs.get("input"), list) and len(kwargs["input"]) > 6:
+            score += 0.5
+        if kwargs.get("tools"):
+            score += 0.5
+        text_format = (kwargs.get("text") or {}).get("format") or {}
+        if text_format.get("type") == "json_schema":
+            properties, depth = _schema_size(text_format.get("schema"))
+            score += properties / 20 + max(depth - 2, 0) * 0.5
+        return score
+
+    def classify(self, route: str, kwargs: Dict[str, Any]) -> str:
+        return "small" if self.score(route, kwargs) < self.threshold else "large"
+
+    def record(self, tier: str, seconds: float, usage: Any = None):
+        self.latency.observe(tier, seconds)
+        self.metrics.increment("cascade", f"{tier}_requests")
+        self.metrics.increment("cascade", f"{tier}_latency_ms", round(seconds * 1000, 1))
+        if usage is not None:
+            self.metrics.increment("cascade", f"{tier}_input_tokens", usage.input_tokens)
+            self.metrics.increment("cascade", f"{tier}_output_tokens", usage.output_tokens)
+
+    def record_escalation(self, route: str):
+        self.metrics.increment("cascade", "escalations")
+        self.metrics.increment("cascade", f"escalations_{route}")
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.metrics.get("cascade", {})
+        total = sum(counters.get(f"{tier}_requests", 0) for tier in TIERS)
+        tiers = {}
+        for tier in TIERS:
+            requests = counters.get(f"{tier}_requests", 0)
+            input_tokens = counters.get(f"{tier}_input_tokens", 0)
+            output_tokens = counters.get(f"{tier}_output_tokens", 0)
+            price = self.prices[tier]
+            tiers[tier] = {
+                "model": self.models[tier],
+                "requests": requests,
+                "share": round(requests / total, 3) if total else 0.0,
+                "avg_latency_ms": round(counters.get(f"{tier}_latency_ms", 0) / requests, 1) if requests else None,
+                # Percentiles cover recent requests on this worker only
+                "p50_latency_ms": round(self.latency.percentile(tier, 50) * 1000, 1) if self.latency.count(tier) else None,
+                "p95_latency_ms": round(self.latency.percentile(tier, 95) * 1000, 1) if self.latency.count(tier) else None,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cost_estimate_usd": round((input_tokens * price["input"] + output_tokens * price["output"]) / 1e6, 4)
+            }
+        small_requests = counters.get("small_requests", 0)
+        escalations = counters.get("escalations", 0)
+        return {
+            "threshold": self.threshold,
+            "tiers": tiers,
+            "escalations": escalations,
+            "escalation_rate": round(escalations / small_requests, 3) if small_requests else 0.0
+        }
@@ -0,0 +1,211 @@
+# Embeddings with dynamic micro-batching and an on-disk vector cache.
+# Concurrent callers' texts are collected for a short window (or until the
+# batch is full) and sent as one upstream request; results are split back to
+# each caller. Vectors are cached by model and content hash: the values live
+# in an append-only float32 file that is memory-mapped for reads, and the
+# shared sqlite store maps each hash to its offset, so every worker shares
+# one cache. The file starts with a random id that prefixes its index keys, so
+# entries written against a deleted or replaced file are never used.
+import os
+import mmap
+import asyncio
+import hashlib
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from shared_state import SharedStore, transaction
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "azure-responses-embeddings.f32")
+HEADER_BYTES = 16
+
+
+def content_key(model: str, text: str) -> str:
+    return model + ":" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _create(path: str):
+    # The header is written to a temporary file and linked into place, so
+    # workers starting together agree on one file id
+    if os.path.exists(path):
+        return
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        os.write(fd, os.urandom(HEADER_BYTES))
+        os.close(fd)
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(temporary)
+
+
+class VectorCache:
+    def __init__(self, path: str, index: SharedStore):
+        self.path = path
+        self.index = index
+        self.lock = threading.Lock()
+        _create(path)
+        self.fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        header = os.pread(self.fd, HEADER_BYTES, 0)
+        if len(header) == HEADER_BYTES:
+            self.file_id = header.hex()
+        else:
+            # A file emptied since it was created has lost its header
+            stat = os.fstat(self.fd)
+            self.file_id = f"{stat.st_dev}:{stat.st_ino}"
+        self.map: Optional[mmap.mmap] = None
+
+    def _read(self, start: int, end: int) -> Optional[bytes]:
+        # Ranges past the end of the file (truncated or replaced since the
+        # entry was written) are misses. Remap when the file has grown past the
+        # mapping, or shrunk under it, where reading would fault.
+        with self.lock:
+            size = os.fstat(self.fd).st_size
+            if start >= end or end > size:
+                return None
+            if self.map is None or len(self.map) < end or len(self.map) > size:
+                if self.map is not None:
+                    self.map.close()
+                self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            return self.map[start:end]
+
+    def get(self, key: str) -> Optional[array]:
+        entry = self.index.get(self.file_id + ":" + key)
+        if entry is None:
+            return None
+        offset, dimensions = entry
+        vector = array("f")
+        data = self._read(offset * vector.itemsize, (offset + dimensions) * vector.itemsize)
+        if data is None or len(data) != dimensions * vector.itemsize:
+            return None
+        vector.frombytes(data)
+        return vector
+
+    def put(self, key: str, vector: List[float]) -> array:
+        # One O_APPEND write per vector, so appends from several workers never
+        # interleave; the offset is read back from where the write ended
+        data = array("f", vector)
+        with self.lock:
+            os.write(self.fd, data.tobytes())
+            end = os.lseek(self.fd, 0, os.SEEK_CUR)
+        self.index[self.file_id + ":" + key] = [end // data.itemsize - len(data), len(data)]
+        return data
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed: Callable[[List[str]], Awaitable[Tuple[List[List[float]], Any]]],
+                 cache: VectorCache, metrics: SharedStore, model: str,
+                 max_batch: int = 256, window: float = 0.01):
+        self.embed = embed
+        self.cache = cache
+        self.metrics = metrics
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.texts: Dict[str, str] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: set = set()
+
+    async def get(self, texts: List[str]) -> Tuple[List[array], int, int]:
+        # Returns float32 vectors in input order, the number of cache hits and
+        # this caller's share of the upstream prompt tokens
+        keys = [content_key(self.model, text) for text in texts]
+        vectors = await asyncio.to_thread(self._lookup, keys)
+        hits = sum(vector is not None for vector in vectors)
+
+        futures = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in futures:
+                futures[key] = self._enqueue(key, text)
+        if futures:
+            # Shielded: a caller that times out must not cancel a batch other
+            # callers are waiting on
+            await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+        vectors = [vector if vector is not None else futures[key].result()[0] for key, vector in zip(keys, vectors)]
+        tokens = round(sum(future.result()[1] for future in futures.values()))
+        return vectors, hits, tokens
+
+    def _lookup(self, keys: List[str]) -> List[Optional[array]]:
+        # Runs in a worker thread: cache reads and metric writes touch disk
+        vectors = [self.cache.get(key) for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        self.metrics.increment("embeddings", "cache_hits", hits)
+        self.metrics.increment("embeddings", "cache_misses", len(keys) - hits)
+        return vectors
+
+    def _enqueue(self, key: str, text: str) -> asyncio.Future:
+        # Identical texts in flight share one future
+        if key in self.pending:
+            return self.pending[key]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[key] = future
+        self.texts[key] = text
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        texts, self.texts = self.texts, {}
+        if batch:
+            task = asyncio.create_task(self._send(batch, texts))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch: Dict[str, asyncio.Future], texts: Dict[str, str]):
+        keys = list(batch)
+        try:
+            counters: Counter = Counter()
+            results, errors = await self._embed(keys, texts, counters)
+            stored = await asyncio.to_thread(self._store, results, counters)
+            for key, (vector, tokens) in stored.items():
+                if not batch[key].done():
+                    batch[key].set_result((vector, tokens))
+            for key, error in errors.items():
+                if not batch[key].done():
+                    batch[key].set_exception(error)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _embed(self, keys: List[str], texts: Dict[str, str],
+                     counters: Counter) -> Tuple[Dict[str, Tuple[List[float], float]], Dict[str, Exception]]:
+        # Returns (key -> (vector, prompt tokens), key -> error). A request
+        # rejected for its input is split in halves until the offending texts
+        # are isolated, so one caller's bad text does not fail the others.
+        try:
+            vectors, usage = await self.embed([texts[key] for key in keys])
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if len(keys) == 1 or status is None or not 400 <= status < 500 or status == 429:
+                return {}, {key: e for key in keys}
+            counters["batch_splits"] += 1
+            middle = len(keys) // 2
+            halves = await asyncio.gather(self._embed(keys[:middle], texts, counters),
+                                          self._embed(keys[middle:], texts, counters))
+            return {**halves[0][0], **halves[1][0]}, {**halves[0][1], **halves[1][1]}
+        # Prompt tokens are split across the request by text length
+        prompt_tokens = usage.prompt_tokens if usage is not None else 0
+        counters.update(batches=1, batched_inputs=len(keys), prompt_tokens=prompt_tokens)
+        total_chars = sum(len(texts[key]) for key in keys) or 1
+        return {key: (vector, prompt_tokens * len(texts[key]) / total_chars)
+                for key, vector in zip(keys, vectors)}, {}
+
+    def _store(self, results: Dict[str, Tuple[List[float], float]], counters: Counter) -> Dict[str, Tuple[array, float]]:
+        # Runs in a worker thread; one transaction for the whole batch
+        with transaction():
+            stored = {key: (self.cache.put(key, vector), tokens) for key, (vector, tokens) in results.items()}
+        for field, amount in counters.items():
+            self.metrics.increment("embeddings", field, amount)
+        return stored
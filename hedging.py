@@ -0,0 +1,92 @@
+# Request hedging for tail latency: if the first upstream call has not
+# returned by the route's live p95, a duplicate is fired and whichever
+# finishes first wins; the loser is cancelled. Hedges are capped by a budget
+# expressed as a fraction of requests.
+import time
+import asyncio
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 500):
+        self.samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def observe(self, route: str, seconds: float):
+        self.samples[route].append(seconds)
+
+    def percentile(self, route: str, pct: float) -> float:
+        ordered = sorted(self.samples[route])
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+    def count(self, route: str) -> int:
+        return len(self.samples[route])
+
+
+class Hedger:
+    def __init__(self, metrics, routes, budget: float = 0.05, percentile: float = 95,
+                 initial_delay: float = 2.0, min_delay: float = 0.05, min_samples: int = 20,
+                 window: int = 500):
+        self.metrics = metrics
+        self.routes = set(routes)
+        self.budget = budget
+        self.pct = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latency = LatencyTracker(window)
+        # 1 for every hedged request in the window, 0 otherwise
+        self.recent: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=window))
+
+    def enabled_for(self, route: str) -> bool:
+        return route in self.routes
+
+    def threshold(self, route: str) -> float:
+        if self.latency.count(route) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.latency.percentile(route, self.pct))
+
+    def within_budget(self, route: str) -> bool:
+        recent = self.recent[route]
+        return sum(recent) < self.budget * max(len(recent), self.min_samples)
+
+    async def run(self, route: str, call: Callable[[bool], Awaitable[Any]]) -> Any:
+        # call(hedged) starts one upstream attempt; hedged is True for the duplicate
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(call(False))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.threshold(route))
+            hedged = not done and self.within_budget(route)
+            self.recent[route].append(1 if hedged else 0)
+            if hedged:
+                self.metrics.increment(route, "hedges_fired")
+                tasks.append(asyncio.ensure_future(call(True)))
+            elif not done:
+                self.metrics.increment(route, "hedges_skipped_budget")
+
+            # First successful attempt wins; fail only when every attempt failed
+            winner, error, pending = None, None, set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = task.exception()
+            if winner is None:
+                raise error
+
+            self.latency.observe(route, time.perf_counter() - started)
+            response = winner.result()
+            if hedged:
+                self.metrics.increment(route, "hedge_wins" if winner is tasks[1] else "primary_wins")
+                # The cancelled attempt was billed for at least its prompt
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    self.metrics.increment(route, "hedge_extra_tokens_estimate", usage.input_tokens)
+            return response
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
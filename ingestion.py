@@ -0,0 +1,206 @@
+# Document ingestion for large file search: reads files via mmap, extracts
+# text, chunks it on paragraph and heading boundaries to a token target with
+# overlap, and content-hashes chunks so identical ones are uploaded once.
+import os
+import re
+import mmap
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional
+    _encoding = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional
+    PdfReader = None
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+HEADING = re.compile(r"^(#{1,6}\s+\S.*|(?=[^a-z]*[A-Z]{3})[A-Z0-9][A-Z0-9 .,:&'-]{2,80})$")
+
+
+@dataclass
+class Chunk:
+    source: str
+    index: int
+    filename: str
+    data: bytes
+    sha256: str
+
+
+@dataclass
+class IngestionResult:
+    chunks: List[Chunk] = field(default_factory=list)
+    duplicate_chunks: int = 0
+    total_bytes: int = 0
+    unique_bytes: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def _read_pdf(path: str) -> Optional[str]:
+    if PdfReader is None:
+        return None
+    reader = PdfReader(path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    return "\n\n".join(pages)
+
+
+def read_text(path: str) -> Optional[str]:
+    # Returns the document text, or None for binary content we cannot extract
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[:5] == b"%PDF-":
+                return _read_pdf(path)
+            if view.find(b"\x00", 0, 8192) != -1:
+                return None
+            try:
+                return str(view[:], "utf-8")
+            except UnicodeDecodeError:
+                return None
+
+
+def _split_blocks(text: str) -> List[str]:
+    # Paragraphs, with headings split off so they always start a new block
+    blocks = []
+    for paragraph in PARAGRAPH_BREAK.split(text.replace("\r\n", "\n")):
+        current = []
+        for line in paragraph.strip().split("\n"):
+            if HEADING.match(line.strip()) and current:
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current and "".join(current).strip():
+            blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_characters(text: str, target_tokens: int) -> List[str]:
+    # Last resort for text without whitespace, such as base64 or minified data
+    tokens = estimate_tokens(text)
+    if tokens <= target_tokens:
+        return [text]
+    step = max(1, len(text) * target_tokens // tokens)
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _split_oversized(block: str, target_tokens: int) -> List[str]:
+    # Break a block larger than the target on sentences, then on words, then
+    # on characters
+    pieces, current, current_tokens = [], [], 0
+    for sentence in SENTENCE_BREAK.split(block):
+        tokens = estimate_tokens(sentence)
+        if tokens > target_tokens:
+            words = sentence.split()
+            step = max(1, len(words) * target_tokens // tokens)
+            units = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+            units = [piece for unit in units for piece in _split_characters(unit, target_tokens)]
+        else:
+            units = [sentence]
+        for unit in units:
+            unit_tokens = estimate_tokens(unit)
+            if current and current_tokens + unit_tokens > target_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += unit_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _tail(text: str, max_tokens: int) -> str:
+    # The trailing sentences of a block that fit in max_tokens, or the trailing
+    # words of its last sentence when even that is too long
+    sentences = SENTENCE_BREAK.split(text)
+    kept, size = [], 0
+    for sentence in reversed(sentences):
+        tokens = estimate_tokens(sentence)
+        if size + tokens > max_tokens:
+            break
+        kept.insert(0, sentence)
+        size += tokens
+    if kept:
+        return " ".join(kept)
+    words = []
+    for word in reversed(sentences[-1].split()):
+        size += estimate_tokens(word)
+        if size > max_tokens:
+            break
+        words.insert(0, word)
+    return " ".join(words)
+
+
+def chunk_text(text: str, target_tokens: int = 800, overlap_tokens: int = 100) -> List[str]:
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    for block in _split_blocks(text):
+        block_tokens = estimate_tokens(block)
+        parts = [block] if block_tokens <= target_tokens else _split_oversized(block, target_tokens)
+        for part in parts:
+            part_tokens = estimate_tokens(part)
+            starts_section = HEADING.match(part.split("\n", 1)[0].strip()) is not None
+            full = current_tokens + part_tokens > target_tokens
+            if current and (full or (starts_section and current_tokens >= target_tokens // 2)):
+                chunks.append("\n\n".join(current))
+                # Carry trailing blocks into the next chunk as overlap, and
+                # the tail of the first block that does not fit whole
+                overlap, overlap_size = [], 0
+                for previous in reversed(current):
+                    size = estimate_tokens(previous)
+                    if overlap_size + size > overlap_tokens:
+                        tail = _tail(previous, overlap_tokens - overlap_size)
+                        if tail:
+                            overlap.insert(0, tail)
+                            overlap_size += estimate_tokens(tail)
+                        break
+                    overlap.insert(0, previous)
+                    overlap_size += size
+                current, current_tokens = overlap, overlap_size
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def ingest_files(file_paths: List[str], target_tokens: int = 800, overlap_tokens: int = 100) -> IngestionResult:
+    result = IngestionResult()
+    seen: Dict[str, Chunk] = {}
+    for path in file_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        text = read_text(path)
+        if text is None:
+            # Binary formats are uploaded whole so the service can parse them
+            with open(path, "rb") as file:
+                payloads = [(os.path.basename(path), file.read())]
+        else:
+            payloads = [
+                (f"{stem}-{index:04d}.txt", chunk.encode("utf-8"))
+                for index, chunk in enumerate(chunk_text(text, target_tokens, overlap_tokens))
+            ]
+
+        for index, (filename, data) in enumerate(payloads):
+            digest = hashlib.sha256(data).hexdigest()
+            result.total_bytes += len(data)
+            if digest in seen:
+                result.duplicate_chunks += 1
+                continue
+            chunk = Chunk(source=path, index=index, filename=filename, data=data, sha256=digest)
+            seen[digest] = chunk
+            result.chunks.append(chunk)
+            result.unique_bytes += len(data)
+    return result
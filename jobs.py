@@ -0,0 +1,224 @@
+# Background job runner with state persisted in the shared sqlite database.
+# Jobs survive restarts: a job whose worker died is picked up again once its
+# lease expires and resumes from its last saved checkpoint.
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import httpx
+from typing import Any, Callable, Dict, Optional
+from shared_state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class JobInterrupted(Exception):
+    # Raised from save_checkpoint when the runner is shutting down
+    pass
+
+
+class Job:
+    def __init__(self, runner: "JobRunner", row: Dict[str, Any]):
+        self.runner = runner
+        self.id = row["id"]
+        self.type = row["type"]
+        self.payload = row["payload"]
+        self.checkpoint = row["checkpoint"] or {}
+
+    def save_checkpoint(self, checkpoint: Dict[str, Any]):
+        self.checkpoint = checkpoint
+        get_connection().execute(
+            "UPDATE jobs SET checkpoint = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(checkpoint), time.time(), self.id)
+        )
+        if self.runner.stopping:
+            raise JobInterrupted(self.id)
+
+    def wait(self, seconds: float):
+        # Sleep between polls without holding up a shutdown
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if self.runner.stopping:
+                raise JobInterrupted(self.id)
+            time.sleep(min(1.0, deadline - time.monotonic()))
+
+
+def _ensure_table():
+    get_connection().execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id TEXT PRIMARY KEY,"
+        " type TEXT NOT NULL,"
+        " status TEXT NOT NULL,"
+        " payload TEXT NOT NULL,"
+        " checkpoint TEXT,"
+        " result TEXT,"
+        " error TEXT,"
+        " callback_url TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " lease_expires REAL,"
+        " created_at REAL NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " run_after REAL)"
+    )
+    # Tables created before retry backoff lack run_after
+    columns = [row[1] for row in get_connection().execute("PRAGMA table_info(jobs)")]
+    if "run_after" not in columns:
+        try:
+            get_connection().execute("ALTER TABLE jobs ADD COLUMN run_after REAL")
+        except sqlite3.OperationalError:
+            pass  # Another worker added it first
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    keys = ("id", "type", "status", "payload", "checkpoint", "result", "error",
+            "callback_url", "attempts", "lease_expires", "created_at", "updated_at", "run_after")
+    job = dict(zip(keys, row))
+    for key in ("payload", "checkpoint", "result"):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+class JobRunner:
+    def __init__(self, lease_seconds: float = 60.0, poll_interval: float = 1.0, max_attempts: int = 3,
+                 retry_delay: float = 10.0):
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.handlers: Dict[str, Callable[[Job], Any]] = {}
+        self.concurrency: Dict[str, int] = {}
+        self.running: Dict[str, asyncio.Task] = {}
+        self.stopping = False
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def register(self, job_type: str, handler: Callable[[Job], Any], concurrency: int = 2):
+        # Concurrency can be overridden per type, e.g. JOB_CONCURRENCY_LARGE_FILESEARCH=4
+        env_name = "JOB_CONCURRENCY_" + job_type.upper().replace("-", "_")
+        self.handlers[job_type] = handler
+        self.concurrency[job_type] = int(os.environ.get(env_name, concurrency))
+
+    def submit(self, job_type: str, payload: Dict[str, Any], callback_url: Optional[str] = None) -> str:
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        _ensure_table()
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        get_connection().execute(
+            "INSERT INTO jobs (id, type, status, payload, callback_url, created_at, updated_at)"
+            " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, job_type, json.dumps(payload), callback_url, now, now)
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        _ensure_table()
+        row = get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+    async def start(self):
+        _ensure_table()
+        self.stopping = False
+        self._loop_task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        self.stopping = True
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+        # Handlers stop at their next checkpoint; anything still running is
+        # picked up again after its lease expires.
+        if self.running:
+            await asyncio.wait(list(self.running.values()), timeout=5)
+
+    def _claim(self, job_type: str) -> Optional[Dict[str, Any]]:
+        # Claim one runnable job if the type is under its concurrency limit
+        # across all worker processes.
+        now = time.time()
+        with transaction() as conn:
+            active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE type = ? AND status = 'running' AND lease_expires >= ?",
+                (job_type, now)
+            ).fetchone()[0]
+            if active >= self.concurrency[job_type]:
+                return None
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE type = ? AND ((status = 'queued' AND (run_after IS NULL OR run_after <= ?))"
+                " OR (status = 'running' AND lease_expires < ?)) ORDER BY created_at LIMIT 1",
+                (job_type, now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1,"
+                " lease_expires = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease_seconds, now, row[0])
+            )
+        job = _row_to_dict(row)
+        job["attempts"] += 1
+        return job
+
+    async def _poll(self):
+        while not self.stopping:
+            try:
+                for job_type in self.handlers:
+                    while not self.stopping:
+                        row = self._claim(job_type)
+                        if row is None:
+                            break
+                        self.running[row["id"]] = asyncio.create_task(self._run(row))
+            except Exception:
+                logger.exception("Job poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            get_connection().execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id)
+            )
+
+    async def _run(self, row: Dict[str, Any]):
+        job = Job(self, row)
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        status, result, error, run_after = "completed", None, None, None
+        try:
+            result = await asyncio.to_thread(self.handlers[job.type], job)
+        except JobInterrupted:
+            status = "queued"
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            status = "failed" if row["attempts"] >= self.max_attempts else "queued"
+            error = str(e)
+            if status == "queued":
+                # Exponential backoff so a transient upstream error has time to clear
+                run_after = time.time() + self.retry_delay * 2 ** (row["attempts"] - 1)
+        finally:
+            heartbeat.cancel()
+            self.running.pop(job.id, None)
+
+        get_connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, lease_expires = NULL, run_after = ?, updated_at = ?"
+            " WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, run_after, time.time(), job.id)
+        )
+        if status in TERMINAL_STATUSES and row["callback_url"]:
+            await self._notify(row["callback_url"], {
+                "job_id": job.id, "type": job.type, "status": status, "result": result, "error": error
+            })
+
+    async def _notify(self, callback_url: str, body: Dict[str, Any]):
+        async with httpx.AsyncClient(timeout=10) as http:
+            for attempt in range(3):
+                try:
+                    response = await http.post(callback_url, json=body)
+                    if response.status_code < 500:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(2 ** attempt)
+        logger.warning("Callback to %s failed for job %s", callback_url, body["job_id"])
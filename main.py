@@ -1,32 +1,103 @@
 import os
-import io
 import json
 import uuid
-import math
+import time
 import base64
 import asyncio
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Response
-from fastapi.responses import StreamingResponse
+import argparse
+import anyio
+import httpx
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Union
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, HttpUrl
-from openai import AzureOpenAI, AsyncAzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI, NotFoundError
 from dotenv import load_dotenv
+from shared_state import CounterStore, SharedStore
+from jobs import Job, JobInterrupted, JobRunner
+from ingestion import ingest_files
+from vector_sync import sync_directory
+from traffic_capture import TrafficCaptureMiddleware, record_upstream
+from hedging import Hedger
+from batch_offline import resolve_data_path, run_batch_offline
+from bm25_index import get_index
+from embeddings import DEFAULT_CACHE_PATH, EmbeddingBatcher, VectorCache
+from cascade import CascadeRouter, validate
+from tracing import TracedRoute, TracingMiddleware, activate, async_event_hooks, current_span, record_span, span, sync_event_hooks
+from profiler import ProfilerBusy, check_token, sample
+from tenancy import ANONYMOUS, BudgetExceeded, FairScheduler, UsageAccounting, estimate_cost, load_json_env, tenant_from_headers, usage_window
 
 # Load environment variables
 load_dotenv()
 
-# Progress tracking for large files
-file_progress = {}
+# Progress tracking for large files, shared between worker processes
+file_progress = SharedStore("file_progress")
+
+# Per-route counters (deadlines, cancelled streams, tokens saved, ...)
+metrics = CounterStore("metrics", flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", "5")))
+
+# Default per-route deadlines in seconds, overridable per request with the
+# X-Request-Timeout header
+DEFAULT_DEADLINE = float(os.environ.get("DEFAULT_REQUEST_DEADLINE", "60"))
+ROUTE_DEADLINES = {
+    "stream": 300.0,
+    "stream-sse": 300.0,
+    "conversation-stream": 300.0,
+    "stream-async": 300.0,
+    "stream-multi": 300.0,
+    "ws-chat": 300.0,
+    "filesearch": 300.0,
+    "large-filesearch": 900.0,
+    "vector-store-sync": 1800.0,
+}
+
+# Background job runner, started with the app
+job_runner = JobRunner(retry_delay=float(os.environ.get("JOB_RETRY_DELAY", "10")))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_runner.start()
+    flusher = asyncio.create_task(tenant_usage.run_flusher())
+    metrics_flusher = asyncio.create_task(metrics.run_flusher())
+    yield
+    # Jobs stop first so usage they hand back to the loop is flushed
+    await job_runner.stop()
+    flusher.cancel()
+    metrics_flusher.cancel()
+    tenant_usage.flush()
+    metrics.flush()
 
 # Initialize FastAPI app
-app = FastAPI(title="Azure OpenAI Responses API")
+app = FastAPI(title="Azure OpenAI Responses API", lifespan=lifespan)
+app.router.route_class = TracedRoute
+
+# Opt-in traffic capture for load testing (see replay.py)
+if os.environ.get("TRAFFIC_CAPTURE_PATH"):
+    app.add_middleware(TrafficCaptureMiddleware, path=os.environ["TRAFFIC_CAPTURE_PATH"])
+
+# Opt-in tracing, exported as OTLP/JSON lines (see "Tracing and Profiling")
+if os.environ.get("TRACE_EXPORT_PATH"):
+    app.add_middleware(
+        TracingMiddleware,
+        path=os.environ["TRACE_EXPORT_PATH"],
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+    )
+
+# Connection pool limits for the upstream clients. Every worker process
+# imports this module and therefore builds its own pool.
+pool_limits = httpx.Limits(
+    max_connections=int(os.environ.get("AZURE_OPENAI_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.environ.get("AZURE_OPENAI_MAX_KEEPALIVE", "20"))
+)
 
 # Initialize Azure OpenAI client
 try:
     client = AzureOpenAI(
         api_key=os.environ["AZURE_OPENAI_API_KEY"],
         api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-        azure_endpoint=os.environ["AZURE_OPENAI_API_ENDPOINT"]
+        azure_endpoint=os.environ["AZURE_OPENAI_API_ENDPOINT"],
+        http_client=httpx.Client(limits=pool_limits, event_hooks=sync_event_hooks())
     )
 except KeyError as e:
     print(f"Missing environment variable: {e}")
@@ -62,59 +133,365 @@ class WeatherRequest(BaseModel):
 class StreamRequest(BaseModel):
     prompt: str
 
+class StreamMultiRequest(BaseModel):
+    prompts: List[str]
+    max_concurrency: int = 4  # Upstream streams open at once
+
 class FileSearchRequest(BaseModel):
     query: str
-    file_paths: List[str]
+    file_paths: List[str] = []
+    vector_store_id: Optional[str] = None  # Query a synced store instead of uploading
     max_results: int = 20
     chunk_size: int = 1024 * 1024  # Default 1MB chunks
+    mode: Literal["remote", "local", "hybrid"] = "remote"  # See "Local BM25 pre-filter" in the README
+    index_name: str = "default"
+    top_k: int = 8  # Local passages used by the local and hybrid modes
 
 class LargeFileSearchRequest(BaseModel):
     query: str
     file_paths: List[str]
     max_results: int = 20
-    chunk_size: int = 1024 * 1024  # Default 1MB chunks
+    chunk_tokens: int = 800  # Target tokens per text chunk
+    chunk_overlap: int = 100  # Tokens repeated between neighbouring chunks
     batch_size: int = 5  # Number of chunks to process at once
 
+class LocalIndexRequest(BaseModel):
+    file_paths: List[str]
+    passage_tokens: int = 200
+    passage_overlap: int = 40
+
+class LocalSearchRequest(BaseModel):
+    query: str
+    top_k: int = 8
+    file_paths: Optional[List[str]] = None  # Restrict results to these files
+
+class VectorStoreSyncRequest(BaseModel):
+    directory: str
+    vector_store_id: Optional[str] = None
+    name: Optional[str] = None
+    max_concurrency: int = 8
+
+class FileSearchJobRequest(FileSearchRequest):
+    callback_url: Optional[HttpUrl] = None
+
+class LargeFileSearchJobRequest(LargeFileSearchRequest):
+    callback_url: Optional[HttpUrl] = None
+
+class BatchOfflineRequest(BaseModel):
+    input_path: str  # JSONL rows of {"id": ..., "prompt": ...} or {"id": ..., "input": [...]}
+    output_path: str
+    json_schema: Optional[Dict[str, Any]] = None
+    system_prompt: Optional[str] = None
+    rows_per_file: int = 50000
+    poll_interval: float = 30.0
+    callback_url: Optional[HttpUrl] = None
+
 class StructuredRequest(BaseModel):
     input: str
     json_schema: Dict[str, Any]  # Renamed from schema to avoid conflict with BaseModel
 
+class EmbeddingsRequest(BaseModel):
+    input: Union[str, List[str]]
+    encoding_format: Literal["float", "base64"] = "float"  # base64 of little-endian float32
+
 # Initialize async client
 async_client = AsyncAzureOpenAI(
     api_key=os.environ["AZURE_OPENAI_API_KEY"],
     api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-    azure_endpoint=os.environ["AZURE_OPENAI_API_ENDPOINT"]
+    azure_endpoint=os.environ["AZURE_OPENAI_API_ENDPOINT"],
+    http_client=httpx.AsyncClient(limits=pool_limits, event_hooks=async_event_hooks())
 )
 
+# Optional request hedging for tail latency on the routes in HEDGE_ROUTES
+hedger = Hedger(
+    metrics,
+    routes=[route.strip() for route in os.environ.get("HEDGE_ROUTES", "").split(",") if route.strip()],
+    budget=float(os.environ.get("HEDGE_BUDGET", "0.05")),
+    percentile=float(os.environ.get("HEDGE_PERCENTILE", "95")),
+    initial_delay=float(os.environ.get("HEDGE_INITIAL_DELAY", "2.0"))
+)
+
+# Per-tenant token accounting, budgets and weighted-fair upstream scheduling.
+# TENANT_BUDGETS and TENANT_WEIGHTS are JSON objects keyed by tenant, with "*"
+# as the default, e.g. {"acme": {"soft": 500000, "hard": 1000000}}.
+tenant_usage = UsageAccounting(
+    SharedStore("tenant_usage"),
+    budgets=load_json_env("TENANT_BUDGETS"),
+    flush_interval=float(os.environ.get("TENANT_FLUSH_INTERVAL", "5"))
+)
+scheduler = FairScheduler(
+    max_concurrency=int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "64")),
+    weights=load_json_env("TENANT_WEIGHTS")
+)
+
+# Embeddings: concurrent requests are micro-batched into one upstream call and
+# vectors are cached on disk by content hash
+EMBEDDING_MODEL = os.environ.get("AZURE_OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+
+async def embed_batch(texts: List[str]):
+    with span("embeddings.create", inputs=len(texts)):
+        response = await async_client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)], response.usage
+
+embedding_batcher = EmbeddingBatcher(
+    embed_batch,
+    VectorCache(os.environ.get("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH), SharedStore("embedding_cache")),
+    metrics,
+    EMBEDDING_MODEL,
+    max_batch=int(os.environ.get("EMBEDDING_MAX_BATCH", "256")),
+    window=float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "10")) / 1000
+)
+
+# Optional cascade routing: simple requests go to AZURE_OPENAI_SMALL_MODEL and
+# hard ones to AZURE_OPENAI_API_MODEL (see "Model Cascade" in the README)
+cascade = CascadeRouter(
+    small_model=os.environ["AZURE_OPENAI_SMALL_MODEL"],
+    large_model=os.environ["AZURE_OPENAI_API_MODEL"],
+    metrics=metrics,
+    threshold=float(os.environ.get("CASCADE_THRESHOLD", "1.0")),
+    route_scores=load_json_env("CASCADE_ROUTE_SCORES"),
+    prices=load_json_env("CASCADE_PRICES")
+) if os.environ.get("AZURE_OPENAI_SMALL_MODEL") else None
+
+def admit_tenant(http_request: Request):
+    tenant = tenant_from_headers(http_request.headers)
+    try:
+        return tenant, tenant_usage.admit(tenant)
+    except BudgetExceeded:
+        raise HTTPException(status_code=429, detail=f"Token budget exceeded for tenant {tenant}")
+
+def remaining_time(expires_at: Optional[float]) -> Optional[float]:
+    # Seconds left for a synchronous pipeline (None when it has no deadline).
+    # The endpoint has already answered 504 once this raises; the worker thread
+    # stops at its next upstream call instead of running on unobserved.
+    if expires_at is None:
+        return None
+    left = expires_at - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("Request deadline exceeded")
+    return left
+
+def create_response(tenant: str, expires_at: Optional[float], **kwargs):
+    # Upstream call for the synchronous pipelines, which run in worker threads
+    if expires_at is not None:
+        kwargs["timeout"] = remaining_time(expires_at)
+    response = client.responses.create(**kwargs)
+    usage = response.usage
+    tenant_usage.record_from_thread(tenant, usage.input_tokens if usage else 0, usage.output_tokens if usage else 0)
+    return response
+
+def request_deadline(http_request: Request, route: str) -> float:
+    header = http_request.headers.get("x-request-timeout")
+    if header is None:
+        return ROUTE_DEADLINES.get(route, DEFAULT_DEADLINE)
+    try:
+        deadline = float(header)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+    if deadline <= 0:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be positive")
+    return deadline
+
+def hedge_model(model: str, tier: Optional[str]) -> str:
+    # AZURE_OPENAI_HEDGE_MODEL is a second deployment of the large model, so
+    # small-tier hedges only move when AZURE_OPENAI_SMALL_HEDGE_MODEL is set
+    if tier == "small":
+        return os.environ.get("AZURE_OPENAI_SMALL_HEDGE_MODEL", model)
+    return os.environ.get("AZURE_OPENAI_HEDGE_MODEL", model)
+
+# Non-streaming upstream call bounded by the request deadline. The deadline is
+# passed down as the SDK timeout and the awaiting task is cancelled once it
+# passes, which aborts the in-flight HTTP request.
+async def call_upstream(http_request: Request, route: str, tier: Optional[str] = None, **kwargs):
+    deadline = request_deadline(http_request, route)
+    tenant, over_soft_budget = admit_tenant(http_request)
+    if cascade is not None:
+        tier = tier or cascade.classify(route, kwargs)
+        kwargs["model"] = cascade.models[tier]
+
+    async def scheduled():
+        # Time spent queued for a slot counts against the deadline
+        queued = time.time_ns()
+        async with scheduler.slot(tenant, estimate_cost(kwargs), over_soft_budget):
+            record_span("scheduler.wait", queued, tenant=tenant)
+            started = time.perf_counter()
+            with span("responses.create", model=kwargs["model"], tier=tier) as upstream_span:
+                if hedger.enabled_for(route):
+                    def attempt(hedged: bool):
+                        model = hedge_model(kwargs["model"], tier) if hedged else kwargs["model"]
+                        return async_client.responses.create(timeout=deadline, **{**kwargs, "model": model})
+                    response = await hedger.run(route, attempt)
+                else:
+                    response = await async_client.responses.create(timeout=deadline, **kwargs)
+                if response.usage is not None:
+                    upstream_span.set(input_tokens=response.usage.input_tokens, output_tokens=response.usage.output_tokens)
+            record_upstream((time.perf_counter() - started) * 1000, response.usage, response.model)
+            if tier is not None:
+                cascade.record(tier, time.perf_counter() - started, response.usage)
+            return response
+
+    try:
+        response = await asyncio.wait_for(scheduled(), timeout=deadline)
+        tenant_usage.record(tenant, response.usage)
+        return response
+    except asyncio.TimeoutError:
+        metrics.increment(route, "deadline_exceeded")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+# Deadline and tenant admission are checked before the streaming response
+# starts, so errors can still be returned as a normal HTTP status.
+def stream_admission(http_request: Request, route: str) -> Dict[str, Any]:
+    deadline = request_deadline(http_request, route)
+    tenant, over_soft_budget = admit_tenant(http_request)
+    return {"deadline": deadline, "tenant": tenant, "over_soft_budget": over_soft_budget}
+
+async def stream_upstream(is_disconnected: Callable[[], Awaitable[bool]], route: str, admission: Dict[str, Any],
+                          cancel_reason: Callable[[], str] = lambda: "disconnected", **kwargs):
+    deadline = admission["deadline"]
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    expires_at = started + deadline
+    usage = None
+    tier = None
+    if cascade is not None:
+        tier = cascade.classify(route, kwargs)
+        kwargs["model"] = cascade.models[tier]
+    # Spans are started explicitly here: a generator may be resumed from a
+    # different context than the one it was created in
+    stream_span = current_span().child("responses.stream", model=kwargs["model"], tier=tier)
+    first_token = False
+    encode_ns = 0
+    events = 0
+
+    try:
+        # The scheduler slot is held for the whole stream
+        queued = time.time_ns()
+        async with scheduler.slot(admission["tenant"], estimate_cost(kwargs), admission["over_soft_budget"]):
+            stream_span.child("scheduler.wait", start_ns=queued, tenant=admission["tenant"]).end()
+            with activate(stream_span):
+                stream = await asyncio.wait_for(
+                    async_client.responses.create(stream=True, timeout=deadline, **kwargs),
+                    timeout=expires_at - loop.time()
+                )
+            async for event in relay_stream(is_disconnected, route, stream, loop, started, expires_at, cancel_reason):
+                if event.type == 'response.completed':
+                    usage = event.response.usage
+                elif event.type == 'response.output_text.delta' and not first_token:
+                    first_token = True
+                    stream_span.child("stream.time_to_first_token", start_ns=stream_span.start_ns).end()
+                # Time until the next event is requested is the caller's SSE
+                # encoding plus the write to the client
+                yielded = time.perf_counter_ns()
+                yield event
+                encode_ns += time.perf_counter_ns() - yielded
+                events += 1
+    finally:
+        tenant_usage.record(admission["tenant"], usage)
+        if tier is not None and usage is not None:
+            cascade.record(tier, loop.time() - started, usage)
+        stream_span.set(events=events, **{"sse.encode_write_ms": round(encode_ns / 1e6, 2)})
+        stream_span.end()
+
+# Relays upstream events and closes the upstream stream as soon as the client
+# disconnects or the deadline passes, so no further tokens are generated for it.
+# A passed deadline is raised as TimeoutError for the caller to report.
+# is_disconnected is polled between events; cancel_reason names a cancellation
+# of the consuming task in the metrics.
+async def relay_stream(is_disconnected: Callable[[], Awaitable[bool]], route: str, stream, loop, started: float,
+                       expires_at: float, cancel_reason: Callable[[], str] = lambda: "disconnected"):
+    iterator = stream.__aiter__()
+    streamed_tokens = 0
+    finished = False
+    reason = "disconnected"
+    try:
+        while True:
+            if await is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(iterator.__anext__(), timeout=expires_at - loop.time())
+            except StopAsyncIteration:
+                finished = True
+                break
+            except asyncio.TimeoutError:
+                reason = "deadline_exceeded"
+                raise
+            if event.type == 'response.output_text.delta':
+                streamed_tokens += 1
+            elif event.type == 'response.completed' and event.response.usage is not None:
+                metrics.increment(route, "completed_streams")
+                metrics.increment(route, "output_tokens", event.response.usage.output_tokens)
+                record_upstream((loop.time() - started) * 1000, event.response.usage, event.response.model)
+            yield event
+    except asyncio.CancelledError:
+        reason = cancel_reason()
+        raise
+    finally:
+        if not finished:
+            record_cancelled_stream(route, reason, streamed_tokens)
+        # Shielded so the close still runs when the response task is cancelled
+        with anyio.CancelScope(shield=True):
+            await stream.close()
+
+async def sse_with_deadline(route: str, chunks):
+    # The 200 status is already sent when a stream hits its deadline, so the
+    # client is told with a final error event instead
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except asyncio.TimeoutError:
+        metrics.increment(route, "deadline_exceeded")
+        yield f"event: error\ndata: {json.dumps({'status': 504, 'detail': 'Request deadline exceeded'})}\n\n"
+    finally:
+        await chunks.aclose()
+
+def record_cancelled_stream(route: str, reason: str, streamed_tokens: int):
+    # Each text delta is roughly one token; the tokens saved are estimated
+    # from the average output length of completed streams on this route.
+    stats = metrics.get(route, {})
+    completed = stats.get("completed_streams", 0)
+    average = stats.get("output_tokens", 0) / completed if completed else 0
+    metrics.increment(route, f"cancelled_{reason}")
+    metrics.increment(route, "tokens_saved_estimate", max(round(average) - streamed_tokens, 0))
+
 # Basic completion endpoint
 @app.post("/basic")
-async def basic_completion(request: BasicPromptRequest):
+async def basic_completion(request: BasicPromptRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "basic",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=request.prompt
         )
         return {"response": response.output_text}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Conversation endpoint
 @app.post("/conversation")
-async def conversation(request: ConversationRequest):
+async def conversation(request: ConversationRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "conversation",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=request.messages
         )
         return {"response": response.output_text}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Image analysis endpoint
 @app.post("/image")
-async def analyze_image(request: ImageRequest):
+async def analyze_image(request: ImageRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "image",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=[
                 {"role": "user", "content": request.prompt},
@@ -130,14 +507,18 @@ async def analyze_image(request: ImageRequest):
             ]
         )
         return {"response": response.output_text}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Image URL analysis endpoint
 @app.post("/image-url")
-async def analyze_image_url(request: ImageUrlRequest):
+async def analyze_image_url(request: ImageUrlRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "image-url",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=[
                 {"role": "user", "content": request.prompt},
@@ -153,12 +534,14 @@ async def analyze_image_url(request: ImageUrlRequest):
             ]
         )
         return {"response": response.output_text}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Weather function endpoint
 @app.post("/weather")
-async def get_weather(request: WeatherRequest):
+async def get_weather(request: WeatherRequest, http_request: Request):
     try:
         tools = [{
             "type": "function",
@@ -174,7 +557,9 @@ async def get_weather(request: WeatherRequest):
             }
         }]
         
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "weather",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=[{"role": "user", "content": f"What's the weather like in {request.location}?"}],
             tools=tools
@@ -191,138 +576,504 @@ async def get_weather(request: WeatherRequest):
             "unit": request.unit,
             "temperature": "22°C"  # Mock value
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Stream endpoint
 @app.post("/stream")
-async def stream_completion(request: StreamRequest):
+async def stream_completion(request: StreamRequest, http_request: Request):
     try:
+        admission = stream_admission(http_request, "stream")
+
         async def generate():
-            stream = client.responses.create(
+            async for event in stream_upstream(
+                http_request.is_disconnected,
+                "stream",
+                admission,
                 model=os.environ["AZURE_OPENAI_API_MODEL"],
-                input=request.prompt,
-                stream=True
-            )
-            for event in stream:
+                input=request.prompt
+            ):
                 if event.type == 'response.output_text.delta':
                     yield f"data: {json.dumps({'delta': event.delta})}\n\n"
         
         return StreamingResponse(
-            generate(),
+            sse_with_deadline("stream", generate()),
             media_type="text/event-stream"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Stream SSE endpoint
 @app.post("/stream-sse")
-async def stream_sse(request: StreamRequest):
+async def stream_sse(request: StreamRequest, http_request: Request):
     try:
+        admission = stream_admission(http_request, "stream-sse")
+
         async def generate():
-            stream = client.responses.create(
+            async for event in stream_upstream(
+                http_request.is_disconnected,
+                "stream-sse",
+                admission,
                 model=os.environ["AZURE_OPENAI_API_MODEL"],
-                input=request.prompt,
-                stream=True
-            )
-            for event in stream:
+                input=request.prompt
+            ):
                 if event.type == 'response.created':
                     yield f"event: created\ndata: {json.dumps({'id': event.response.id})}\n\n"
                 elif event.type == 'response.output_text.delta':
                     yield f"event: delta\ndata: {json.dumps({'text': event.delta})}\n\n"
         
         return StreamingResponse(
-            generate(),
+            sse_with_deadline("stream-sse", generate()),
             media_type="text/event-stream"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Conversation stream endpoint
 @app.post("/conversation-stream")
-async def conversation_stream(request: ConversationRequest):
+async def conversation_stream(request: ConversationRequest, http_request: Request):
     try:
+        admission = stream_admission(http_request, "conversation-stream")
+
         async def generate():
-            stream = client.responses.create(
+            async for event in stream_upstream(
+                http_request.is_disconnected,
+                "conversation-stream",
+                admission,
                 model=os.environ["AZURE_OPENAI_API_MODEL"],
-                input=request.messages,
-                stream=True
-            )
-            for event in stream:
+                input=request.messages
+            ):
                 if event.type == 'response.created':
                     yield f"event: created\ndata: {json.dumps({'id': event.response.id})}\n\n"
                 elif event.type == 'response.output_text.delta':
                     yield f"event: delta\ndata: {json.dumps({'text': event.delta})}\n\n"
         
         return StreamingResponse(
-            generate(),
+            sse_with_deadline("conversation-stream", generate()),
             media_type="text/event-stream"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Stream async endpoint
 @app.post("/stream-async")
-async def stream_async(request: StreamRequest):
+async def stream_async(request: StreamRequest, http_request: Request):
     try:
+        admission = stream_admission(http_request, "stream-async")
+
         async def generate():
-            stream = await async_client.responses.create(
+            async for event in stream_upstream(
+                http_request.is_disconnected,
+                "stream-async",
+                admission,
                 model=os.environ["AZURE_OPENAI_API_MODEL"],
-                input=request.prompt,
-                stream=True
-            )
-            async for event in stream:
+                input=request.prompt
+            ):
                 if hasattr(event, "delta") and event.delta:
                     yield f"data: {json.dumps({'delta': event.delta})}\n\n"
         
+        return StreamingResponse(
+            sse_with_deadline("stream-async", generate()),
+            media_type="text/event-stream"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Multiplexed stream endpoint: several prompts on one SSE connection. Each
+# prompt streams into its own small buffer and the response takes one event
+# from each stream with data in turn, so a long generation cannot crowd out
+# the others. A full buffer pauses reading from that upstream stream.
+STREAM_MULTI_MAX_PROMPTS = int(os.environ.get("STREAM_MULTI_MAX_PROMPTS", "32"))
+STREAM_MULTI_BUFFER = 32
+
+@app.post("/stream-multi")
+async def stream_multi(request: StreamMultiRequest, http_request: Request):
+    if not 1 <= len(request.prompts) <= STREAM_MULTI_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {STREAM_MULTI_MAX_PROMPTS} prompts")
+    if request.max_concurrency < 1:
+        raise HTTPException(status_code=400, detail="max_concurrency must be at least 1")
+    try:
+        admission = stream_admission(http_request, "stream-multi")
+        semaphore = asyncio.Semaphore(request.max_concurrency)
+        queues = [asyncio.Queue(maxsize=STREAM_MULTI_BUFFER) for _ in request.prompts]
+        ready = asyncio.Event()
+
+        async def produce(index: int, prompt: str):
+            queue = queues[index]
+            try:
+                response_id = None
+                async with semaphore:
+                    async for event in stream_upstream(
+                        http_request.is_disconnected,
+                        "stream-multi",
+                        admission,
+                        model=os.environ["AZURE_OPENAI_API_MODEL"],
+                        input=prompt
+                    ):
+                        if event.type == 'response.output_text.delta':
+                            await queue.put(("delta", {"stream": index, "text": event.delta}))
+                            ready.set()
+                        elif event.type == 'response.completed':
+                            response_id = event.response.id
+                if response_id is None:
+                    await queue.put(("error", {"stream": index, "detail": "Stream ended before completion"}))
+                else:
+                    await queue.put(("done", {"stream": index, "id": response_id}))
+            except asyncio.TimeoutError:
+                await queue.put(("error", {"stream": index, "detail": "Request deadline exceeded"}))
+            except Exception as e:
+                await queue.put(("error", {"stream": index, "detail": str(e)}))
+            ready.set()
+
+        async def generate():
+            tasks = [asyncio.create_task(produce(i, prompt)) for i, prompt in enumerate(request.prompts)]
+            active = list(range(len(request.prompts)))
+            failed = 0
+            try:
+                while active:
+                    ready.clear()
+                    sent = False
+                    for index in list(active):
+                        if queues[index].empty():
+                            continue
+                        kind, data = queues[index].get_nowait()
+                        sent = True
+                        if kind != "delta":
+                            active.remove(index)
+                            failed += kind == "error"
+                        yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+                    if not sent:
+                        await ready.wait()
+                yield f"event: end\ndata: {json.dumps({'streams': len(request.prompts), 'failed': failed})}\n\n"
+            finally:
+                # Client gone or deadline hit: stop every upstream stream
+                for task in tasks:
+                    task.cancel()
+
         return StreamingResponse(
             generate(),
             media_type="text/event-stream"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# File search endpoint
-@app.post("/filesearch")
-async def file_search(request: FileSearchRequest):
+# One assistant turn of a WebSocket chat session. Deltas are sent as they
+# arrive; the next upstream event is not read until the previous send has
+# completed, so a slow client applies back-pressure to the upstream stream.
+async def run_chat_turn(websocket: WebSocket, session: Dict[str, Any], content: Any):
     try:
-        # Create a vector store
+        admission = stream_admission(websocket, "ws-chat")
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        return
+
+    async def closed() -> bool:
+        return session["closed"]
+
+    # Turns share the streaming pipeline with the SSE routes: cascade routing,
+    # scheduling, deadline, traffic capture and cancellation accounting
+    events = stream_upstream(
+        closed,
+        "ws-chat",
+        admission,
+        cancel_reason=lambda: "disconnected" if session["closed"] else "cancelled",
+        model=os.environ["AZURE_OPENAI_API_MODEL"],
+        input=content,
+        previous_response_id=session["previous_response_id"]
+    )
+    try:
+        async for event in events:
+            if event.type == 'response.created':
+                await websocket.send_json({"type": "created", "response_id": event.response.id})
+            elif event.type == 'response.output_text.delta':
+                await websocket.send_json({"type": "delta", "text": event.delta})
+            elif event.type == 'response.completed':
+                usage = event.response.usage
+                # The server keeps the chain so clients never pass ids around
+                session["previous_response_id"] = event.response.id
+                await websocket.send_json({
+                    "type": "done",
+                    "response_id": event.response.id,
+                    "usage": usage.model_dump() if usage is not None else None
+                })
+    except asyncio.CancelledError:
+        if not session["closed"]:
+            await websocket.send_json({"type": "cancelled"})
+    except asyncio.TimeoutError:
+        metrics.increment("ws-chat", "deadline_exceeded")
+        await websocket.send_json({"type": "error", "status": 504, "detail": "Request deadline exceeded"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        await websocket.send_json({"type": "error", "status": 500, "detail": str(e)})
+    finally:
+        # Closes the upstream stream now rather than when the generator is collected
+        with anyio.CancelScope(shield=True):
+            await events.aclose()
+
+# WebSocket chat endpoint: one connection per session, one message per turn
+@app.websocket("/ws/chat")
+async def websocket_chat(websocket: WebSocket):
+    await websocket.accept()
+    session = {"previous_response_id": websocket.query_params.get("previous_response_id"), "closed": False}
+    turn: Optional[asyncio.Task] = None
+    try:
+        while True:
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+            try:
+                message = json.loads(received.get("text") or received.get("bytes") or "")
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "status": 400, "detail": "Messages must be JSON objects"})
+                continue
+            if message.get("type") == "cancel":
+                if turn is not None and not turn.done():
+                    turn.cancel()
+            elif message.get("type") == "reset":
+                session["previous_response_id"] = None
+            elif message.get("type") == "user":
+                if turn is not None and not turn.done():
+                    await websocket.send_json({"type": "error", "status": 409, "detail": "A response is already in progress"})
+                    continue
+                turn = asyncio.create_task(run_chat_turn(websocket, session, message.get("content")))
+            else:
+                await websocket.send_json({"type": "error", "status": 400, "detail": "Unknown message type"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # However the connection ends, an in-flight turn must not keep streaming
+        session["closed"] = True
+        if turn is not None and not turn.done():
+            turn.cancel()
+
+# File search pipeline shared by the endpoint and the background job
+def run_file_search(request: FileSearchRequest, tenant: str, expires_at: Optional[float] = None) -> Dict[str, Any]:
+    if request.mode != "remote":
+        return run_local_file_search(request, tenant, expires_at)
+
+    if request.vector_store_id:
+        # The store is kept up to date by /vector-store/sync
+        return {"response": query_vector_store(request.vector_store_id, request, tenant, expires_at)}
+
+    return {"response": upload_and_query(request.file_paths, request, tenant, expires_at)}
+
+def upload_and_query(file_paths: List[str], request: FileSearchRequest, tenant: str,
+                     expires_at: Optional[float] = None) -> str:
+    # Create a vector store
+    with span("vector_store.create"):
         vector_store = client.vector_stores.create(
-            name="Search Documents"
+            name="Search Documents",
+            **({"timeout": remaining_time(expires_at)} if expires_at is not None else {})
         )
 
+    file_streams = [open(path, "rb") for path in file_paths]
+    try:
         # Upload files
-        file_streams = [open(path, "rb") for path in request.file_paths]
-        file_batch = client.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=vector_store.id,
-            files=file_streams
-        )
+        remaining_time(expires_at)
+        with span("vector_store.upload_and_poll", files=len(file_streams)):
+            file_batch = client.vector_stores.file_batches.upload_and_poll(
+                vector_store_id=vector_store.id,
+                files=file_streams
+            )
 
         # Query the vector store
-        response = client.responses.create(
+        output_text = query_vector_store(vector_store.id, request, tenant, expires_at)
+    finally:
+        # Cleanup
+        for stream in file_streams:
+            stream.close()
+        with span("vector_store.delete"):
+            client.vector_stores.delete(vector_store_id=vector_store.id)
+
+    return output_text
+
+# Local and hybrid file search. The local BM25 index picks the top passages;
+# "local" sends them inline as context and skips the vector store entirely,
+# "hybrid" uploads only the files those passages came from.
+def run_local_file_search(request: FileSearchRequest, tenant: str, expires_at: Optional[float] = None) -> Dict[str, Any]:
+    index = get_index(request.index_name)
+    if request.file_paths:
+        with span("local_index.add_files", files=len(request.file_paths)):
+            index.add_files(request.file_paths)
+
+    started = time.perf_counter()
+    with span("local_index.search", top_k=request.top_k):
+        passages = index.search(request.query, request.top_k, request.file_paths or None)
+    search_ms = round((time.perf_counter() - started) * 1000, 2)
+    if not passages:
+        return {"response": None, "passages": [], "search_ms": search_ms}
+
+    if request.mode == "hybrid":
+        sources = list(dict.fromkeys(passage["source"] for passage in passages))
+        return {
+            "response": upload_and_query(sources, request, tenant, expires_at),
+            "files_uploaded": sources,
+            "search_ms": search_ms
+        }
+
+    context = "\n\n".join(
+        f"[{i + 1}] {os.path.basename(passage['source'])}\n{passage['text']}"
+        for i, passage in enumerate(passages)
+    )
+    with span("responses.create", passages=len(passages)):
+        response = create_response(
+            tenant,
+            expires_at,
+            model=os.environ["AZURE_OPENAI_API_MODEL"],
+            input=[
+                {"role": "system", "content": "Answer using only the numbered passages below and cite them by number.\n\n" + context},
+                {"role": "user", "content": request.query}
+            ]
+        )
+    return {
+        "response": response.output_text,
+        "passages": [{"source": p["source"], "score": p["score"]} for p in passages],
+        "search_ms": search_ms
+    }
+
+def query_vector_store(vector_store_id: str, request: FileSearchRequest, tenant: str,
+                       expires_at: Optional[float] = None) -> str:
+    with span("responses.create", tool="file_search"):
+        response = create_response(
+            tenant,
+            expires_at,
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             tools=[{
                 "type": "file_search",
-                "vector_store_ids": [vector_store.id],
+                "vector_store_ids": [vector_store_id],
                 "max_num_results": request.max_results
             }],
             input=request.query
         )
+    return response.output_text
 
-        # Cleanup
-        for stream in file_streams:
-            stream.close()
-        client.vector_stores.delete(vector_store_id=vector_store.id)
+# File search endpoint
+@app.post("/filesearch")
+async def file_search(request: FileSearchRequest, http_request: Request):
+    if request.mode == "remote" and not request.file_paths and not request.vector_store_id:
+        raise HTTPException(status_code=400, detail="Provide file_paths or vector_store_id")
+    tenant, _ = admit_tenant(http_request)
+    deadline = request_deadline(http_request, "filesearch")
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(run_file_search, request, tenant, time.monotonic() + deadline),
+            timeout=deadline
+        )
+    except (asyncio.TimeoutError, TimeoutError):
+        metrics.increment("filesearch", "deadline_exceeded")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {"response": response.output_text}
+# Add or refresh files in a local BM25 index; unchanged files are skipped
+@app.post("/local-index/{index_name}/documents")
+async def local_index_documents(index_name: str, request: LocalIndexRequest):
+    missing = [path for path in request.file_paths if not os.path.isfile(path)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Files not found: {missing}")
+    try:
+        index = get_index(index_name)
+        return await asyncio.to_thread(
+            index.add_files, request.file_paths, request.passage_tokens, request.passage_overlap
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Query a local BM25 index without calling the model
+@app.post("/local-index/{index_name}/search")
+async def local_index_search(index_name: str, request: LocalSearchRequest):
+    try:
+        index = get_index(index_name)
+        started = time.perf_counter()
+        passages = await asyncio.to_thread(index.search, request.query, request.top_k, request.file_paths)
+        return {"passages": passages, "search_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Incremental vector store sync endpoint
+@app.post("/vector-store/sync")
+async def vector_store_sync(request: VectorStoreSyncRequest, http_request: Request):
+    if not os.path.isdir(request.directory):
+        raise HTTPException(status_code=400, detail="Directory not found")
+    deadline = request_deadline(http_request, "vector-store-sync")
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(
+                sync_directory,
+                client,
+                request.directory,
+                request.vector_store_id,
+                request.name,
+                request.max_concurrency,
+                expires_at=time.monotonic() + deadline
+            ),
+            timeout=deadline
+        )
+    except (asyncio.TimeoutError, TimeoutError):
+        metrics.increment("vector-store-sync", "deadline_exceeded")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Embeddings endpoint
+@app.post("/embeddings")
+async def create_embeddings(request: EmbeddingsRequest, http_request: Request):
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    if not texts or not all(texts):
+        raise HTTPException(status_code=400, detail="input must be a non-empty string or list of non-empty strings")
+    deadline = request_deadline(http_request, "embeddings")
+    tenant, over_soft_budget = admit_tenant(http_request)
+
+    async def embed():
+        # Each request waits its weighted-fair turn and holds the slot until its micro-batch returns
+        async with scheduler.slot(tenant, estimate_cost({"input": texts}, expected_output=0), over_soft_budget):
+            return await embedding_batcher.get(texts)
+
+    try:
+        vectors, cached, prompt_tokens = await asyncio.wait_for(embed(), timeout=deadline)
+        tenant_usage.record_tokens(tenant, prompt_tokens, 0)
+        if request.encoding_format == "base64":
+            # The cached float32 bytes as-is, far cheaper to encode than JSON floats
+            data = [base64.b64encode(vector.tobytes()).decode("ascii") for vector in vectors]
+        else:
+            data = [vector.tolist() for vector in vectors]
+        return {
+            "model": EMBEDDING_MODEL,
+            "data": [{"index": i, "embedding": embedding} for i, embedding in enumerate(data)],
+            "cached": cached
+        }
+    except asyncio.TimeoutError:
+        metrics.increment("embeddings", "deadline_exceeded")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Structured output endpoint
 @app.post("/structured")
-async def structured_output(request: StructuredRequest):
+async def structured_output(request: StructuredRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        kwargs = dict(
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=[
                 {"role": "system", "content": "Extract structured information."},
@@ -337,86 +1088,125 @@ async def structured_output(request: StructuredRequest):
                 }
             }
         )
+        tier = cascade.classify("structured", kwargs) if cascade is not None else None
+        response = await call_upstream(http_request, "structured", tier=tier, **kwargs)
+        if tier == "small":
+            # Escalate to the large model when the small one's output is
+            # incomplete, not JSON or does not match the schema
+            try:
+                output = json.loads(response.output_text)
+                if response.status == "completed" and validate(output, request.json_schema):
+                    return {"response": output}
+            except ValueError:
+                pass
+            cascade.record_escalation("structured")
+            response = await call_upstream(http_request, "structured", tier="large", **kwargs)
         return {"response": json.loads(response.output_text)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Large file search endpoint with chunking and progress tracking
-@app.post("/large-filesearch")
-async def large_file_search(request: LargeFileSearchRequest):
+# Large file search pipeline with text-aware chunking and progress tracking. When run as
+# a job, progress is checkpointed after every batch so a restarted job resumes
+# from the last completed chunk.
+def run_large_file_search(request: LargeFileSearchRequest, search_id: str, tenant: str,
+                          job: Optional[Job] = None, expires_at: Optional[float] = None) -> Dict[str, Any]:
+    checkpoint = job.checkpoint if job is not None else {}
+    vector_store_id = None
     try:
-        search_id = str(uuid.uuid4())
-        file_progress[search_id] = {
-            "total_chunks": 0,
-            "processed_chunks": 0,
-            "status": "initializing"
-        }
+        if checkpoint:
+            vector_store_id = checkpoint["vector_store_id"]
+        else:
+            file_progress[search_id] = {
+                "total_chunks": 0,
+                "processed_chunks": 0,
+                "status": "initializing"
+            }
 
-        # Create a vector store
-        vector_store = client.vector_stores.create(
-            name=f"Large Search Documents {search_id}"
+            # Create a vector store
+            vector_store_id = client.vector_stores.create(
+                name=f"Large Search Documents {search_id}",
+                **({"timeout": remaining_time(expires_at)} if expires_at is not None else {})
+            ).id
+        completed_chunks = checkpoint.get("completed_chunks", 0)
+        results = checkpoint.get("results", [])
+
+        # Extract text, chunk it on structural boundaries and drop duplicate
+        # chunks so identical content is uploaded only once
+        with span("ingestion", files=len(request.file_paths)) as ingestion_span:
+            ingestion = ingest_files(request.file_paths, request.chunk_tokens, request.chunk_overlap)
+            ingestion_span.set(chunks=len(ingestion.chunks), duplicate_chunks=ingestion.duplicate_chunks)
+        total_chunks = len(ingestion.chunks)
+
+        file_progress.update(
+            search_id,
+            total_chunks=total_chunks,
+            processed_chunks=completed_chunks,
+            duplicate_chunks=ingestion.duplicate_chunks,
+            upload_bytes=ingestion.unique_bytes,
+            status="processing"
         )
 
-        # Calculate total chunks for all files
-        total_chunks = 0
-        for file_path in request.file_paths:
-            file_size = os.path.getsize(file_path)
-            total_chunks += math.ceil(file_size / request.chunk_size)
-        
-        file_progress[search_id]["total_chunks"] = total_chunks
-        file_progress[search_id]["status"] = "processing"
-
-        results = []
-        for file_path in request.file_paths:
-            with open(file_path, 'rb') as file:
-                chunk_batches = []
-                current_batch = []
-                
-                while True:
-                    chunk = file.read(request.chunk_size)
-                    if not chunk:
-                        break
-                    
-                    current_batch.append(chunk)
-                    if len(current_batch) >= request.batch_size:
-                        chunk_batches.append(current_batch)
-                        current_batch = []
-                
-                if current_batch:
-                    chunk_batches.append(current_batch)
-
-                for batch in chunk_batches:
-                    # Process batch of chunks
-                    file_batch = client.vector_stores.file_batches.upload_and_poll(
-                        vector_store_id=vector_store.id,
-                        files=[io.BytesIO(chunk) for chunk in batch]
-                    )
-                    
-                    # Update progress
-                    file_progress[search_id]["processed_chunks"] += len(batch)
-                    
-                    # Query the vector store for this batch
-                    response = client.responses.create(
-                        model=os.environ["AZURE_OPENAI_API_MODEL"],
-                        tools=[{
-                            "type": "file_search",
-                            "vector_store_ids": [vector_store.id],
-                            "max_num_results": request.max_results
-                        }],
-                        input=request.query
-                    )
-                    
-                    if response.output_text.strip():
-                        results.append(response.output_text)
+        for start in range(completed_chunks, total_chunks, request.batch_size):
+            batch = ingestion.chunks[start:start + request.batch_size]
+
+            # Process batch of chunks
+            remaining_time(expires_at)
+            with span("vector_store.upload_and_poll", files=len(batch)):
+                file_batch = client.vector_stores.file_batches.upload_and_poll(
+                    vector_store_id=vector_store_id,
+                    files=[(chunk.filename, chunk.data) for chunk in batch]
+                )
+
+            # Update progress
+            file_progress.increment(search_id, "processed_chunks", len(batch))
+
+            # Query the vector store for this batch
+            with span("responses.create", tool="file_search"):
+                response = create_response(
+                    tenant,
+                    expires_at,
+                    model=os.environ["AZURE_OPENAI_API_MODEL"],
+                    tools=[{
+                        "type": "file_search",
+                        "vector_store_ids": [vector_store_id],
+                        "max_num_results": request.max_results
+                    }],
+                    input=request.query
+                )
+
+            if response.output_text.strip():
+                results.append(response.output_text)
+
+            if job is not None:
+                job.save_checkpoint({
+                    "vector_store_id": vector_store_id,
+                    "completed_chunks": start + len(batch),
+                    "results": results
+                })
+
+        # Cleanup. A retry after a failed summary finds the store already gone.
+        if not checkpoint.get("store_deleted"):
+            try:
+                client.vector_stores.delete(vector_store_id=vector_store_id)
+            except NotFoundError:
+                pass
+            if job is not None:
+                job.save_checkpoint({
+                    "vector_store_id": vector_store_id,
+                    "completed_chunks": total_chunks,
+                    "results": results,
+                    "store_deleted": True
+                })
+
+        file_progress.update(search_id, status="completed")
 
-        # Cleanup
-        client.vector_stores.delete(vector_store_id=vector_store.id)
-        
-        file_progress[search_id]["status"] = "completed"
-        
         # Combine and summarize results
         combined_results = "\n\n".join(results)
-        final_response = client.responses.create(
+        final_response = create_response(
+            tenant,
+            expires_at,
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=f"Summarize and combine these search results about '{request.query}':\n\n{combined_results}"
         )
@@ -426,10 +1216,33 @@ async def large_file_search(request: LargeFileSearchRequest):
             "status": "completed",
             "response": final_response.output_text
         }
+    except JobInterrupted:
+        raise
+    except Exception:
+        if search_id in file_progress:
+            file_progress.update(search_id, status="failed")
+        if job is None and vector_store_id is not None:
+            # Nothing resumes a direct request, so its store is removed now
+            try:
+                client.vector_stores.delete(vector_store_id=vector_store_id)
+            except Exception:
+                pass
+        raise
 
+# Large file search endpoint with chunking and progress tracking
+@app.post("/large-filesearch")
+async def large_file_search(request: LargeFileSearchRequest, http_request: Request):
+    tenant, _ = admit_tenant(http_request)
+    deadline = request_deadline(http_request, "large-filesearch")
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(run_large_file_search, request, str(uuid.uuid4()), tenant, None, time.monotonic() + deadline),
+            timeout=deadline
+        )
+    except (asyncio.TimeoutError, TimeoutError):
+        metrics.increment("large-filesearch", "deadline_exceeded")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
     except Exception as e:
-        if search_id in file_progress:
-            file_progress[search_id]["status"] = "failed"
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get search progress endpoint
@@ -446,14 +1259,18 @@ async def get_search_progress(search_id: str):
         "status": progress["status"],
         "progress_percentage": round(percentage, 2),
         "processed_chunks": progress["processed_chunks"],
-        "total_chunks": progress["total_chunks"]
+        "total_chunks": progress["total_chunks"],
+        "duplicate_chunks": progress.get("duplicate_chunks", 0),
+        "upload_bytes": progress.get("upload_bytes", 0)
     }
 
 # Chained response endpoint using previous_response_id
 @app.post("/chained-response")
-async def chained_response(request: ChainedRequest):
+async def chained_response(request: ChainedRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "chained-response",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=request.input,
             previous_response_id=request.previous_response_id
@@ -462,14 +1279,18 @@ async def chained_response(request: ChainedRequest):
             "response_id": response.id,
             "response": response.output_text
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Manual chained response endpoint using message history
 @app.post("/manual-chain")
-async def manual_chain(request: ManualChainRequest):
+async def manual_chain(request: ManualChainRequest, http_request: Request):
     try:
-        response = client.responses.create(
+        response = await call_upstream(
+            http_request,
+            "manual-chain",
             model=os.environ["AZURE_OPENAI_API_MODEL"],
             input=request.inputs
         )
@@ -483,9 +1304,151 @@ async def manual_chain(request: ManualChainRequest):
                 }
             ]
         }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Background jobs for long-running file search work
+def admit_job(job: Job) -> str:
+    # The tenant is resolved at submit time; its budget is checked again when
+    # the job runs since the job may have waited in the queue
+    tenant = job.payload.get("tenant", ANONYMOUS)
+    try:
+        tenant_usage.admit(tenant)
+    except BudgetExceeded:
+        raise RuntimeError(f"Token budget exceeded for tenant {tenant}")
+    return tenant
+
+def file_search_job(job: Job) -> Dict[str, Any]:
+    return run_file_search(FileSearchRequest(**job.payload), admit_job(job))
+
+def large_file_search_job(job: Job) -> Dict[str, Any]:
+    # The job id doubles as the search id so the progress endpoint works
+    return run_large_file_search(LargeFileSearchRequest(**job.payload), job.id, admit_job(job), job)
+
+job_runner.register("filesearch", file_search_job, concurrency=4)
+job_runner.register("large-filesearch", large_file_search_job, concurrency=2)
+
+def batch_offline_job(job: Job) -> Dict[str, Any]:
+    request = BatchOfflineRequest(**job.payload)
+    tenant = admit_job(job)
+    result = run_batch_offline(
+        client,
+        job,
+        # Checked again in case the job was queued before the paths were confined
+        resolve_data_path(request.input_path),
+        resolve_data_path(request.output_path),
+        model=os.environ.get("AZURE_OPENAI_BATCH_MODEL", os.environ["AZURE_OPENAI_API_MODEL"]),
+        json_schema=request.json_schema,
+        system_prompt=request.system_prompt,
+        rows_per_file=request.rows_per_file,
+        poll_interval=request.poll_interval
+    )
+    tenant_usage.record_from_thread(tenant, result["usage"]["input_tokens"], result["usage"]["output_tokens"],
+                                    requests=result["succeeded"] + result["failed"])
+    return result
+
+job_runner.register("batch-offline", batch_offline_job, concurrency=1)
+
+def submit_job(job_type: str, request: BaseModel, http_request: Request) -> Dict[str, Any]:
+    tenant, _ = admit_tenant(http_request)
+    payload = request.model_dump(mode="json", exclude={"callback_url"})
+    payload["tenant"] = tenant
+    callback_url = str(request.callback_url) if request.callback_url else None
+    job_id = job_runner.submit(job_type, payload, callback_url)
+    return {"job_id": job_id, "status": "queued"}
+
+# Submit file search job endpoint
+@app.post("/jobs/filesearch")
+async def submit_file_search_job(request: FileSearchJobRequest, http_request: Request):
+    if request.mode == "remote" and not request.file_paths and not request.vector_store_id:
+        raise HTTPException(status_code=400, detail="Provide file_paths or vector_store_id")
+    return submit_job("filesearch", request, http_request)
+
+# Submit large file search job endpoint
+@app.post("/jobs/large-filesearch")
+async def submit_large_file_search_job(request: LargeFileSearchJobRequest, http_request: Request):
+    return submit_job("large-filesearch", request, http_request)
+
+# Submit offline Batch API job endpoint
+@app.post("/batch-offline")
+async def submit_batch_offline_job(request: BatchOfflineRequest, http_request: Request):
+    try:
+        request.input_path = resolve_data_path(request.input_path)
+        request.output_path = resolve_data_path(request.output_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.isfile(request.input_path):
+        raise HTTPException(status_code=400, detail="Input file not found")
+    return submit_job("batch-offline", request, http_request)
+
+# Get job status and result endpoint
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job ID not found")
+    return {
+        "job_id": job["id"],
+        "type": job["type"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"]
+    }
+
+# Per-tenant token usage for the current day
+@app.get("/tenants/usage")
+async def get_tenant_usage():
+    return {"window": usage_window(), "tenants": tenant_usage.usage()}
+
+# Per-route counters endpoint
+@app.get("/metrics")
+async def get_metrics():
+    return dict(metrics.items())
+
+# Cascade routing stats: per-tier traffic share, latency, tokens, estimated
+# cost and escalation rate
+@app.get("/cascade/stats")
+async def get_cascade_stats():
+    if cascade is None:
+        return {"enabled": False}
+    return {"enabled": True, **cascade.stats()}
+
+# Sampling profile of the worker that serves the request, in folded stack
+# format. Disabled unless DEBUG_PROFILE_TOKEN is set; send it as X-Debug-Token.
+@app.get("/debug/profile")
+async def debug_profile(http_request: Request, seconds: float = 10.0, interval_ms: float = 10.0):
+    allowed = check_token(http_request.headers.get("x-debug-token"))
+    if allowed is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 60] and interval_ms in [1, 1000]")
+    try:
+        # Sampled from a worker thread so the event loop keeps serving traffic
+        folded = await asyncio.to_thread(sample, seconds, interval_ms / 1000)
+        return PlainTextResponse(folded, headers={"X-Profiled-Pid": str(os.getpid())})
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    parser = argparse.ArgumentParser(description="Run the Azure OpenAI Responses API server")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")),
+                        help="Number of worker processes; send SIGHUP to the parent for a graceful rolling reload")
+    parser.add_argument("--reload", action="store_true", help="Restart the server on code changes (development only)")
+    args = parser.parse_args()
+
+    if args.workers > 1 or args.reload:
+        # Workers and the reloader import the app by name in fresh processes
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, reload=args.reload)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,251 @@
+# Local stand-in for the Azure OpenAI Responses, Embeddings and Batch APIs,
+# for load tests, replays and offline batch runs without spending tokens.
+# Point the service at it with
+#   AZURE_OPENAI_API_ENDPOINT=http://localhost:9000
+# and start it with
+#   uvicorn mock_upstream:app --port 9000
+import os
+import json
+import time
+import uuid
+import random
+import base64
+import asyncio
+import tempfile
+from array import array
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+
+# Latency is drawn from a log-normal distribution to mimic a long tail
+LATENCY_MS = float(os.environ.get("MOCK_LATENCY_MS", "300"))
+LATENCY_SIGMA = float(os.environ.get("MOCK_LATENCY_SIGMA", "0.5"))
+OUTPUT_TOKENS = int(os.environ.get("MOCK_OUTPUT_TOKENS", "50"))
+TOKEN_INTERVAL_MS = float(os.environ.get("MOCK_TOKEN_INTERVAL_MS", "20"))
+STORAGE_DIR = os.environ.get("MOCK_STORAGE_DIR") or tempfile.mkdtemp(prefix="mock-upstream-")
+BATCH_DELAY_S = float(os.environ.get("MOCK_BATCH_DELAY_S", "1"))
+EMBEDDING_DIM = int(os.environ.get("MOCK_EMBEDDING_DIM", "1536"))
+
+files = {}
+batches = {}
+
+app = FastAPI(title="Mock Azure OpenAI upstream")
+
+
+def sample_latency() -> float:
+    return random.lognormvariate(0, LATENCY_SIGMA) * LATENCY_MS / 1000
+
+
+def count_input_tokens(body) -> int:
+    return max(1, len(json.dumps(body.get("input", ""))) // 4)
+
+
+def response_object(body, text: str, status: str = "completed"):
+    input_tokens = count_input_tokens(body)
+    output_tokens = OUTPUT_TOKENS if status == "completed" else 0
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "mock"),
+        "status": status,
+        "output": [] if status != "completed" else [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}]
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": body.get("tools", []),
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens
+        }
+    }
+
+
+def mock_text(body) -> str:
+    # Structured output requests get a JSON object back
+    text_format = (body.get("text") or {}).get("format") or {}
+    if text_format.get("type") == "json_schema":
+        properties = text_format.get("schema", {}).get("properties", {})
+        return json.dumps({name: "mock" for name in properties})
+    return " ".join(f"token{i}" for i in range(OUTPUT_TOKENS))
+
+
+def sse(event_type: str, data) -> str:
+    return f"event: {event_type}\ndata: {json.dumps({'type': event_type, **data})}\n\n"
+
+
+async def stream_events(body):
+    text = mock_text(body)
+    final = response_object(body, text)
+    yield sse("response.created", {"sequence_number": 0, "response": response_object(body, "", "in_progress")})
+    await asyncio.sleep(sample_latency())
+    words = text.split(" ")
+    for index, word in enumerate(words):
+        delta = word if index == len(words) - 1 else word + " "
+        yield sse("response.output_text.delta", {
+            "sequence_number": index + 1,
+            "item_id": final["output"][0]["id"],
+            "output_index": 0,
+            "content_index": 0,
+            "delta": delta,
+            "logprobs": []
+        })
+        await asyncio.sleep(TOKEN_INTERVAL_MS / 1000)
+    yield sse("response.completed", {"sequence_number": len(words) + 1, "response": final})
+
+
+@app.post("/openai/responses")
+@app.post("/openai/v1/responses")
+@app.post("/openai/deployments/{deployment}/responses")
+async def create_response(request: Request, deployment: str = None):
+    body = await request.json()
+    if body.get("stream"):
+        return StreamingResponse(stream_events(body), media_type="text/event-stream")
+    await asyncio.sleep(sample_latency() + OUTPUT_TOKENS * TOKEN_INTERVAL_MS / 1000)
+    return response_object(body, mock_text(body))
+
+
+# Embeddings: deterministic pseudo-random unit vectors per input text
+@app.post("/openai/embeddings")
+@app.post("/openai/deployments/{deployment}/embeddings")
+async def create_embeddings(request: Request, deployment: str = None):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(sample_latency() / 4)
+    data = []
+    for index, text in enumerate(inputs):
+        rng = random.Random(text)
+        vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIM)]
+        norm = sum(value * value for value in vector) ** 0.5
+        vector = [value / norm for value in vector]
+        if body.get("encoding_format") == "base64":
+            vector = base64.b64encode(array("f", vector).tobytes()).decode()
+        data.append({"object": "embedding", "index": index, "embedding": vector})
+    tokens = sum(max(1, len(text) // 4) for text in inputs)
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", deployment or "mock"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+
+# Files and Batch API, enough for the offline batch pipeline
+@app.post("/openai/files")
+async def upload_file(request: Request):
+    boundary = request.headers["content-type"].split("boundary=", 1)[1].encode()
+    file_id = f"file-{uuid.uuid4().hex}"
+    path = os.path.join(STORAGE_DIR, file_id)
+    fields, filename = {}, "upload"
+    for part in (await request.body()).split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        headers, content = part.split(b"\r\n\r\n", 1)
+        content = content[:-2] if content.endswith(b"\r\n") else content
+        name = headers.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+        if b'filename="' in headers:
+            filename = headers.split(b'filename="', 1)[1].split(b'"', 1)[0].decode()
+            with open(path, "wb") as file:
+                file.write(content)
+        else:
+            fields[name] = content.decode()
+    files[file_id] = {
+        "id": file_id,
+        "object": "file",
+        "bytes": os.path.getsize(path),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": fields.get("purpose", "batch"),
+        "status": "processed"
+    }
+    return files[file_id]
+
+
+@app.get("/openai/files/{file_id}")
+async def retrieve_file(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="File not found")
+    return files[file_id]
+
+
+@app.get("/openai/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(os.path.join(STORAGE_DIR, file_id), media_type="application/jsonl")
+
+
+def process_batch(batch_id: str):
+    batch = batches[batch_id]
+    output_id = f"file-{uuid.uuid4().hex}"
+    path = os.path.join(STORAGE_DIR, output_id)
+    count = 0
+    with open(os.path.join(STORAGE_DIR, batch["input_file_id"])) as source, open(path, "w") as output:
+        for line in source:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.write(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": response_object(request["body"], mock_text(request["body"]))
+                },
+                "error": None
+            }) + "\n")
+            count += 1
+    files[output_id] = {
+        "id": output_id, "object": "file", "bytes": os.path.getsize(path),
+        "created_at": int(time.time()), "filename": f"{batch_id}_output.jsonl",
+        "purpose": "batch_output", "status": "processed"
+    }
+    batch.update(
+        status="completed",
+        output_file_id=output_id,
+        completed_at=int(time.time()),
+        request_counts={"total": count, "completed": count, "failed": 0}
+    )
+
+
+async def run_batch(batch_id: str):
+    batches[batch_id]["status"] = "in_progress"
+    await asyncio.sleep(BATCH_DELAY_S)
+    await asyncio.to_thread(process_batch, batch_id)
+
+
+@app.post("/openai/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    if body["input_file_id"] not in files:
+        raise HTTPException(status_code=404, detail="Input file not found")
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": body["endpoint"],
+        "completion_window": body["completion_window"],
+        "input_file_id": body["input_file_id"],
+        "created_at": int(time.time()),
+        "status": "validating",
+        "output_file_id": None,
+        "error_file_id": None,
+        "request_counts": {"total": 0, "completed": 0, "failed": 0}
+    }
+    asyncio.create_task(run_batch(batch_id))
+    return batches[batch_id]
+
+
+@app.get("/openai/batches/{batch_id}")
+async def retrieve_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batches[batch_id]
@@ -0,0 +1,55 @@
+# On-demand sampling profiler for the live process. A background thread
+# snapshots the stacks of every other thread at a fixed interval and counts
+# identical stacks; nothing is instrumented, so the cost is one stack walk per
+# thread per sample. The output is in folded format ("frame;frame;frame count"
+# per line), which flamegraph.pl, speedscope and inferno read directly.
+import os
+import sys
+import hmac
+import time
+import threading
+from collections import Counter
+from typing import Optional
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def sample(seconds: float, interval: float = 0.01, max_depth: int = 128) -> str:
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < max_depth:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(";", ","))
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    finally:
+        _lock.release()
+
+
+def check_token(provided: Optional[str]) -> Optional[bool]:
+    # None when profiling is disabled, otherwise whether the token matches
+    expected = os.environ.get("DEBUG_PROFILE_TOKEN")
+    if not expected:
+        return None
+    return provided is not None and hmac.compare_digest(provided, expected)
@@ -0,0 +1,115 @@
+# Replays traffic captured by traffic_capture.py against a running service,
+# preserving inter-arrival times (scaled by --speed) and concurrency, then
+# reports latency deltas against the captured run per route.
+#
+#   python replay.py capture.jsonl --target http://localhost:8000 --speed 2
+import sys
+import json
+import time
+import asyncio
+import argparse
+import httpx
+from collections import defaultdict
+from typing import Any, Dict, List
+
+
+def load_records(path: str, limit: int = 0) -> List[Dict[str, Any]]:
+    records = []
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                records.append(json.loads(line))
+                if limit and len(records) >= limit:
+                    break
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def peak_concurrency(records: List[Dict[str, Any]]) -> int:
+    # Highest number of overlapping requests in the capture
+    edges = []
+    for record in records:
+        edges.append((record["t"], 1))
+        edges.append((record["t"] + record["ms"] / 1000, -1))
+    peak = current = 0
+    for _, change in sorted(edges):
+        current += change
+        peak = max(peak, current)
+    return max(peak, 1)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def send(http: httpx.AsyncClient, record: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    url = record["r"] + (f"?{record['q']}" if record.get("q") else "")
+    try:
+        async with http.stream(record["m"], url, json=record.get("b"), headers=record.get("h")) as response:
+            async for _ in response.aiter_raw():
+                pass
+            status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"route": record["r"], "status": status,
+            "ms": (time.perf_counter() - started) * 1000, "recorded_ms": record["ms"]}
+
+
+async def replay(records: List[Dict[str, Any]], target: str, speed: float, concurrency: int) -> List[Dict[str, Any]]:
+    # speed 0 means as fast as possible, bounded by the concurrency limit
+    semaphore = asyncio.Semaphore(concurrency)
+    origin = records[0]["t"]
+    async with httpx.AsyncClient(base_url=target, timeout=None,
+                                 limits=httpx.Limits(max_connections=concurrency)) as http:
+        start = time.perf_counter()
+
+        async def scheduled(record):
+            if speed > 0:
+                delay = (record["t"] - origin) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            async with semaphore:
+                return await send(http, record)
+
+        return await asyncio.gather(*(scheduled(record) for record in records))
+
+
+def report(results: List[Dict[str, Any]]):
+    by_route = defaultdict(list)
+    for result in results:
+        by_route[result["route"]].append(result)
+    print(f"{'route':<40} {'n':>6} {'err':>5} {'p50':>16} {'p95':>16} {'p99':>16}")
+    for route, items in sorted(by_route.items()):
+        errors = sum(1 for item in items if not (isinstance(item["status"], int) and item["status"] < 400))
+        columns = []
+        for pct in (50, 95, 99):
+            recorded = percentile([item["recorded_ms"] for item in items], pct)
+            replayed = percentile([item["ms"] for item in items], pct)
+            columns.append(f"{replayed:7.0f} ({replayed - recorded:+.0f})")
+        print(f"{route:<40} {len(items):>6} {errors:>5} " + " ".join(f"{c:>16}" for c in columns))
+    print("latencies in ms, replayed (delta vs captured)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the service")
+    parser.add_argument("capture", help="Capture log written with TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Time scale: 1 = real time, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="Maximum in-flight requests (default: unbounded when timed, "
+                             "peak concurrency of the capture at --speed 0)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    args = parser.parse_args()
+
+    records = load_records(args.capture, args.limit)
+    if not records:
+        sys.exit("Capture log is empty")
+    concurrency = args.concurrency or (peak_concurrency(records) if args.speed == 0 else len(records))
+    print(f"Replaying {len(records)} requests at speed {args.speed or 'max'} with concurrency {concurrency}")
+    report(asyncio.run(replay(records, args.target, args.speed, concurrency)))
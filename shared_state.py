@@ -0,0 +1,214 @@
+# Process-shared state backed by sqlite so that every uvicorn worker sees the
+# same progress records, caches and counters.
+import os
+import json
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = os.path.join(tempfile.gettempdir(), "azure-responses-state.sqlite3")
+
+_local = threading.local()
+
+
+def state_path() -> str:
+    return os.environ.get("SHARED_STATE_PATH", DEFAULT_STATE_PATH)
+
+
+def get_connection() -> sqlite3.Connection:
+    # One connection per thread and per process; sqlite connections must not
+    # be shared across forks or used concurrently from several threads.
+    path = state_path()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid() or getattr(_local, "path", None) != path:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = path
+    return conn
+
+
+class transaction:
+    # BEGIN IMMEDIATE takes the write lock up front so read-modify-write
+    # sequences are atomic across worker processes.
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn = get_connection()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+
+
+class SharedStore:
+    """Dict-like JSON store for one namespace of the shared sqlite database."""
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = get_connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        get_connection().execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+            (self.namespace, key, json.dumps(value)),
+        )
+
+    def __delitem__(self, key: str) -> None:
+        get_connection().execute(
+            "DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return get_connection().execute(
+            "SELECT 1 FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone() is not None
+
+    def keys(self) -> Iterator[str]:
+        rows = get_connection().execute(
+            "SELECT key FROM kv WHERE namespace = ? ORDER BY key", (self.namespace,)
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        rows = get_connection().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? ORDER BY key", (self.namespace,)
+        ).fetchall()
+        return iter([(row[0], json.loads(row[1])) for row in rows])
+
+    def update(self, key: str, **fields: Any) -> Dict[str, Any]:
+        # Merge fields into the stored dict atomically
+        with transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            value = json.loads(row[0]) if row else {}
+            value.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                (self.namespace, key, json.dumps(value)),
+            )
+        return value
+
+    def increment(self, key: str, field: str, amount: float = 1) -> float:
+        # Add amount to a numeric field of the stored dict atomically
+        return self.increment_many(key, {field: amount})[field]
+
+    def increment_many(self, key: str, amounts: Dict[str, float]) -> Dict[str, Any]:
+        # Add to several numeric fields of the stored dict in one transaction
+        with transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            value = json.loads(row[0]) if row else {}
+            for field, amount in amounts.items():
+                value[field] = value.get(field, 0) + amount
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                (self.namespace, key, json.dumps(value)),
+            )
+        return value
+
+    def clear(self) -> None:
+        get_connection().execute("DELETE FROM kv WHERE namespace = ?", (self.namespace,))
+
+
+class CounterStore(SharedStore):
+    """SharedStore whose increments are buffered per process and flushed periodically.
+
+    Hot-path counters would otherwise take the cross-process write lock on
+    every increment. Reads overlay the unflushed amounts, so this process
+    always sees its own counts; other workers see them after the next flush.
+    """
+
+    def __init__(self, namespace: str, flush_interval: float = 5.0):
+        super().__init__(namespace)
+        self.flush_interval = flush_interval
+        self.pending: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def increment(self, key: str, field: str, amount: float = 1) -> float:
+        with self.lock:
+            counters = self.pending.setdefault(key, {})
+            counters[field] = counters.get(field, 0) + amount
+            return counters[field]
+
+    def _overlay(self, key: str, value: Any) -> Any:
+        with self.lock:
+            counters = dict(self.pending.get(key, {}))
+        if not counters:
+            return value
+        value = dict(value) if isinstance(value, dict) else {}
+        for field, amount in counters.items():
+            value[field] = value.get(field, 0) + amount
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = super().get(key, _MISSING)
+        if value is _MISSING:
+            with self.lock:
+                if key not in self.pending:
+                    return default
+            value = {}
+        return self._overlay(key, value)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        stored = dict(super().items())
+        with self.lock:
+            keys = sorted(set(stored) | set(self.pending))
+        return iter([(key, self._overlay(key, stored.get(key, {}))) for key in keys])
+
+    def flush(self) -> None:
+        # One transaction per key; whatever was not written is merged back
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for key in list(pending):
+            try:
+                self.increment_many(key, pending[key])
+            except Exception:
+                with self.lock:
+                    for unwritten, counters in pending.items():
+                        merged = self.pending.setdefault(unwritten, {})
+                        for field, amount in counters.items():
+                            merged[field] = merged.get(field, 0) + amount
+                raise
+            del pending[key]
+
+    async def run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # Off the event loop: the write lock may be held by another worker
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Counter flush for %s failed, retrying in %ss", self.namespace, self.flush_interval)
+
+
+_MISSING = object()
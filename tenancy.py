@@ -0,0 +1,192 @@
+# Per-tenant token accounting and budget-aware scheduling of upstream calls.
+# Usage is counted in per-process counters that only the event loop thread
+# mutates, so no locks are needed; they are flushed to the shared store
+# periodically. Upstream calls are dispatched by start-time fair queuing
+# weighted per tenant, and tenants over their soft budget are deprioritized
+# while tenants over their hard budget are rejected.
+import os
+import json
+import time
+import heapq
+import asyncio
+import hashlib
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+from shared_state import SharedStore
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS = "anonymous"
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def tenant_from_headers(headers) -> str:
+    # Explicit tenant header first, then a hash of the caller's API key
+    tenant = headers.get("x-tenant-id")
+    if tenant:
+        return tenant
+    api_key = headers.get("x-api-key") or headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return ANONYMOUS
+
+
+def usage_window() -> str:
+    # Budgets reset daily (UTC)
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class UsageAccounting:
+    def __init__(self, store: SharedStore, budgets: Dict[str, Dict[str, int]], flush_interval: float = 5.0):
+        self.store = store
+        self.budgets = budgets
+        self.flush_interval = flush_interval
+        self.pending: Dict[str, Dict[str, int]] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def record(self, tenant: str, usage: Any):
+        if usage is None:
+            self.record_tokens(tenant, 0, 0)
+        else:
+            self.record_tokens(tenant, usage.input_tokens, usage.output_tokens)
+
+    def record_tokens(self, tenant: str, input_tokens: int, output_tokens: int, requests: int = 1):
+        counters = self.pending.setdefault(tenant, {"requests": 0, "input_tokens": 0, "output_tokens": 0})
+        counters["requests"] += requests
+        counters["input_tokens"] += input_tokens
+        counters["output_tokens"] += output_tokens
+
+    def record_from_thread(self, tenant: str, input_tokens: int, output_tokens: int, requests: int = 1):
+        # Worker threads hand their usage to the event loop thread that owns the counters
+        if self.loop is None or self.loop.is_closed():
+            self.record_tokens(tenant, input_tokens, output_tokens, requests)
+        else:
+            self.loop.call_soon_threadsafe(self.record_tokens, tenant, input_tokens, output_tokens, requests)
+
+    def flush(self):
+        # Swap the counters out before writing so new records go to a fresh
+        # dict; one transaction per tenant, and whatever was not written is
+        # merged back for the next flush
+        pending, self.pending = self.pending, {}
+        window = usage_window()
+        for tenant in list(pending):
+            amounts = {field: amount for field, amount in pending[tenant].items() if amount}
+            if amounts:
+                try:
+                    self.store.increment_many(f"{window}:{tenant}", amounts)
+                except Exception:
+                    for unwritten, counters in pending.items():
+                        self.record_tokens(unwritten, counters["input_tokens"], counters["output_tokens"],
+                                           counters["requests"])
+                    raise
+            del pending[tenant]
+
+    async def run_flusher(self):
+        self.loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Tenant usage flush failed, retrying in %ss", self.flush_interval)
+
+    def tokens_used(self, tenant: str) -> int:
+        stored = self.store.get(f"{usage_window()}:{tenant}", {})
+        local = self.pending.get(tenant, {})
+        return sum(source.get(field, 0) for source in (stored, local)
+                   for field in ("input_tokens", "output_tokens"))
+
+    def budget_state(self, tenant: str) -> str:
+        budget = self.budgets.get(tenant) or self.budgets.get("*")
+        if not budget:
+            return "ok"
+        used = self.tokens_used(tenant)
+        if "hard" in budget and used >= budget["hard"]:
+            return "hard"
+        if "soft" in budget and used >= budget["soft"]:
+            return "soft"
+        return "ok"
+
+    def admit(self, tenant: str) -> bool:
+        # Rejects tenants over their hard budget; True when over the soft one
+        state = self.budget_state(tenant)
+        if state == "hard":
+            raise BudgetExceeded(tenant)
+        return state == "soft"
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        self.flush()
+        prefix = usage_window() + ":"
+        return {key[len(prefix):]: value for key, value in self.store.items() if key.startswith(prefix)}
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int, weights: Dict[str, float], soft_budget_penalty: float = 0.1):
+        self.max_concurrency = max_concurrency
+        self.weights = weights
+        self.soft_budget_penalty = soft_budget_penalty
+        self.active = 0
+        self.virtual_time = 0.0
+        self.finish_tags: Dict[str, float] = {}
+        self.queue: List = []
+        self.sequence = itertools.count()
+
+    def weight(self, tenant: str, over_soft_budget: bool) -> float:
+        weight = self.weights.get(tenant, self.weights.get("*", 1.0))
+        return weight * self.soft_budget_penalty if over_soft_budget else weight
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, cost: float, over_soft_budget: bool = False):
+        start_tag = max(self.virtual_time, self.finish_tags.get(tenant, 0.0))
+        self.finish_tags[tenant] = start_tag + cost / self.weight(tenant, over_soft_budget)
+
+        if self.active < self.max_concurrency and not self.queue:
+            self.active += 1
+            self.virtual_time = start_tag
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            entry = (start_tag, next(self.sequence), waiter)
+            heapq.heappush(self.queue, entry)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.cancelled():
+                    # Cancelled while queued, e.g. by the request deadline. A
+                    # release may already have popped and skipped the entry.
+                    if entry in self.queue:
+                        self.queue.remove(entry)
+                        heapq.heapify(self.queue)
+                else:
+                    # A slot handed over just before cancellation is passed on
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        # Hand the slot to the next live waiter; waiters cancelled in the same
+        # loop iteration are still queued but already done, so skip them
+        while self.queue:
+            start_tag, _, waiter = heapq.heappop(self.queue)
+            if not waiter.done():
+                self.virtual_time = start_tag
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+def load_json_env(name: str) -> Dict[str, Any]:
+    value = os.environ.get(name)
+    return json.loads(value) if value else {}
+
+
+def estimate_cost(kwargs: Dict[str, Any], expected_output: int = 256) -> float:
+    # Rough token cost used for queue ordering before the real usage is known
+    return len(json.dumps(kwargs.get("input", ""), default=str)) / 4 + expected_output
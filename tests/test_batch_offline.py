@@ -0,0 +1,65 @@
+import json
+import pytest
+from contextlib import contextmanager
+from types import SimpleNamespace
+from batch_offline import resolve_data_path, run_batch_offline
+
+
+class FakeJob:
+    checkpoint = {}
+
+    def save_checkpoint(self, checkpoint):
+        self.checkpoint = checkpoint
+
+    def wait(self, seconds):
+        pass
+
+
+class ExpiredBatchClient:
+    # The batch expires after answering only the first row
+    def __init__(self):
+        self.files = SimpleNamespace(create=self.create_file,
+                                     with_streaming_response=SimpleNamespace(content=self.content))
+        self.batches = SimpleNamespace(create=self.create_batch, retrieve=self.retrieve_batch)
+
+    def create_file(self, file, purpose):
+        self.first_id = json.loads(file.readline())["custom_id"]
+        return SimpleNamespace(id="file-in")
+
+    def create_batch(self, **kwargs):
+        return SimpleNamespace(id="batch-1", status="validating")
+
+    def retrieve_batch(self, batch_id):
+        return SimpleNamespace(status="expired", output_file_id="file-out", error_file_id=None)
+
+    @contextmanager
+    def content(self, file_id):
+        line = json.dumps({"custom_id": self.first_id, "response": {"status_code": 200, "body": {
+            "output": [{"content": [{"type": "output_text", "text": "ok"}]}]
+        }}})
+        yield SimpleNamespace(iter_lines=lambda: [line])
+
+
+def test_rows_missing_from_an_expired_batch_are_reported(tmp_path):
+    input_path = tmp_path / "input.jsonl"
+    input_path.write_text("".join(json.dumps({"id": f"row-{i}", "prompt": "hi"}) + "\n" for i in range(3)))
+    output_path = tmp_path / "output.jsonl"
+
+    result = run_batch_offline(ExpiredBatchClient(), FakeJob(), str(input_path), str(output_path), "m", poll_interval=0)
+
+    assert result["succeeded"] == 1
+    assert result["failed"] == 2
+    lines = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [line["id"] for line in lines] == ["row-0", "row-1", "row-2"]
+    assert lines[1]["error"] == {"message": "No result returned, batch expired"}
+
+
+def test_paths_are_confined_to_the_data_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("BATCH_DATA_DIR", str(tmp_path))
+    (tmp_path / "link").symlink_to("/etc")
+
+    assert resolve_data_path("nightly/input.jsonl") == str(tmp_path / "nightly" / "input.jsonl")
+    assert resolve_data_path(str(tmp_path / "out.jsonl")) == str(tmp_path / "out.jsonl")
+    for path in ("../outside.jsonl", "/etc/passwd", "link/passwd", "."):
+        with pytest.raises(ValueError):
+            resolve_data_path(path)
@@ -0,0 +1,64 @@
+import os
+import pytest
+import bm25_index
+from bm25_index import LocalIndex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHARED_STATE_PATH", str(tmp_path / "state.sqlite"))
+    monkeypatch.setenv("LOCAL_INDEX_DIR", str(tmp_path / "index"))
+    return LocalIndex("docs")
+
+
+def test_unchanged_files_are_not_rehashed(tmp_path, index, monkeypatch):
+    path = tmp_path / "notes.txt"
+    path.write_text("The quick brown fox jumps over the lazy dog.")
+    assert index.add_files([str(path)])["indexed_files"] == 1
+
+    hashed = []
+    digest = bm25_index._file_digest
+    monkeypatch.setattr(bm25_index, "_file_digest", lambda source: hashed.append(source) or digest(source))
+
+    assert index.add_files([str(path)])["unchanged_files"] == 1
+    assert hashed == []
+
+    # Same content under a new mtime is hashed once, then skipped again
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.add_files([str(path)])["indexed_files"] == 0
+    assert index.add_files([str(path)])["unchanged_files"] == 1
+    assert len(hashed) == 1
+
+    path.write_text("Foxes are clever animals that live in dens.")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert index.add_files([str(path)])["indexed_files"] == 1
+    assert index.search("dens")[0]["source"] == str(path)
+
+
+def test_unreadable_file_is_stamped_and_drops_old_passages(tmp_path, index, monkeypatch):
+    path = tmp_path / "report.bin"
+    path.write_text("Quarterly revenue grew in every region.")
+    assert index.add_files([str(path)])["indexed_files"] == 1
+    assert index.search("revenue")
+
+    # The file turns into binary content with no extractable text
+    stat = os.stat(path)
+    path.write_bytes(b"\x00\x01binary revenue\x00")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.add_files([str(path)])["unreadable_files"] == 1
+    assert index.search("revenue") == []
+
+    hashed = []
+    digest = bm25_index._file_digest
+    monkeypatch.setattr(bm25_index, "_file_digest", lambda source: hashed.append(source) or digest(source))
+    assert index.add_files([str(path)])["unchanged_files"] == 1
+    assert hashed == []
+
+    other = tmp_path / "other.txt"
+    other.write_text("Foxes live in dens.")
+    index.add_files([str(other)])
+    index.compact()
+    assert index.search("revenue") == []
+    assert index.search("dens")[0]["source"] == str(other)
+    assert index.add_files([str(path)])["unchanged_files"] == 1
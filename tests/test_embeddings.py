@@ -0,0 +1,77 @@
+import os
+import asyncio
+import pytest
+from types import SimpleNamespace
+from embeddings import EmbeddingBatcher, VectorCache
+from shared_state import SharedStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHARED_STATE_PATH", str(tmp_path / "state.sqlite"))
+    return SharedStore("embedding_cache")
+
+
+def test_round_trip(tmp_path, store):
+    cache = VectorCache(str(tmp_path / "vectors.f32"), store)
+    cache.put("m:a", [1.0, 2.0, 3.0])
+    cache.put("m:b", [4.0, 5.0])
+    assert cache.get("m:a").tolist() == [1.0, 2.0, 3.0]
+    assert cache.get("m:b").tolist() == [4.0, 5.0]
+    assert cache.get("m:c") is None
+
+
+def test_entries_from_a_replaced_file_are_not_used(tmp_path, store):
+    path = str(tmp_path / "vectors.f32")
+    VectorCache(path, store).put("m:a", [1.0, 2.0, 3.0])
+    os.remove(path)
+
+    cache = VectorCache(path, store)
+    cache.put("m:b", [7.0, 8.0, 9.0])
+    assert cache.get("m:a") is None
+    assert cache.get("m:b").tolist() == [7.0, 8.0, 9.0]
+
+
+def test_truncated_or_empty_file_is_a_miss(tmp_path, store):
+    path = str(tmp_path / "vectors.f32")
+    cache = VectorCache(path, store)
+    cache.put("m:a", [1.0, 2.0])
+    cache.put("m:b", [3.0, 4.0])
+    assert cache.get("m:b") is not None
+
+    os.truncate(path, os.path.getsize(path) - 4)
+    assert cache.get("m:a").tolist() == [1.0, 2.0]
+    assert cache.get("m:b") is None
+
+    os.truncate(path, 0)
+    assert cache.get("m:a") is None
+
+
+class InputRejected(Exception):
+    status_code = 400
+
+
+def test_bad_input_only_fails_its_own_caller(tmp_path, store):
+    calls = []
+
+    async def embed(texts):
+        calls.append(len(texts))
+        if "bad" in texts:
+            raise InputRejected("input too long")
+        return [[float(len(text))] for text in texts], SimpleNamespace(prompt_tokens=len(texts))
+
+    async def scenario():
+        cache = VectorCache(str(tmp_path / "vectors.f32"), store)
+        batcher = EmbeddingBatcher(embed, cache, SharedStore("metrics"), "m", window=0.01)
+        return await asyncio.gather(
+            batcher.get(["one", "two"]),
+            batcher.get(["bad"]),
+            batcher.get(["three"]),
+            return_exceptions=True
+        )
+
+    first, second, third = asyncio.run(scenario())
+    assert [vector.tolist() for vector in first[0]] == [[3.0], [3.0]]
+    assert isinstance(second, InputRejected)
+    assert third[0][0].tolist() == [5.0]
+    assert calls[0] == 4 and len(calls) > 1
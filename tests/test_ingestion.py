@@ -0,0 +1,24 @@
+from ingestion import chunk_text, estimate_tokens
+
+
+def test_overlap_carries_the_tail_of_a_large_block():
+    paragraphs = [
+        " ".join(f"Paragraph {p} sentence {s} describes the quarterly results in some detail." for s in range(14))
+        for p in range(20)
+    ]
+    chunks = chunk_text("\n\n".join(paragraphs), 400, 100)
+
+    assert len(chunks) > 1
+    for previous, following in zip(chunks, chunks[1:]):
+        carried = following.split("\n\n")[0]
+        assert carried in previous
+        assert 0 < estimate_tokens(carried) <= 100
+
+
+def test_text_without_whitespace_is_split():
+    text = "x" * 100000
+    chunks = chunk_text(text, 800, 0)
+
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 800 for chunk in chunks)
+    assert "".join(chunks) == text
@@ -0,0 +1,44 @@
+import time
+import asyncio
+import pytest
+from jobs import JobRunner
+from shared_state import get_connection
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHARED_STATE_PATH", str(tmp_path / "state.sqlite"))
+
+
+def failing(job):
+    raise RuntimeError("upstream 503")
+
+
+def test_failed_job_is_retried_after_a_backoff():
+    runner = JobRunner(retry_delay=30)
+    runner.register("flaky", failing)
+    job_id = runner.submit("flaky", {})
+
+    row = runner._claim("flaky")
+    asyncio.run(runner._run(row))
+
+    job = runner.get(job_id)
+    assert job["status"] == "queued"
+    assert job["run_after"] > time.time() + 25
+    assert runner._claim("flaky") is None
+
+    get_connection().execute("UPDATE jobs SET run_after = ? WHERE id = ?", (time.time() - 1, job_id))
+    assert runner._claim("flaky")["id"] == job_id
+
+
+def test_run_after_is_added_to_existing_tables():
+    get_connection().execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, type TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL,"
+        " checkpoint TEXT, result TEXT, error TEXT, callback_url TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+        " lease_expires REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    runner = JobRunner()
+    runner.register("noop", lambda job: None)
+    job_id = runner.submit("noop", {})
+    assert runner.get(job_id)["run_after"] is None
+    assert runner._claim("noop")["id"] == job_id
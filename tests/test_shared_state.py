@@ -0,0 +1,42 @@
+import pytest
+from shared_state import CounterStore, SharedStore
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHARED_STATE_PATH", str(tmp_path / "state.sqlite"))
+
+
+def test_counters_are_buffered_until_flush():
+    counters = CounterStore("metrics")
+    counters.increment("cascade", "small_requests")
+    counters.increment("cascade", "small_latency_ms", 12.5)
+
+    # Other workers only see the counts once they are flushed
+    assert SharedStore("metrics").get("cascade") is None
+    assert counters.get("cascade") == {"small_requests": 1, "small_latency_ms": 12.5}
+
+    counters.flush()
+    counters.increment("cascade", "small_requests")
+    assert SharedStore("metrics").get("cascade") == {"small_requests": 1, "small_latency_ms": 12.5}
+    assert counters.get("cascade") == {"small_requests": 2, "small_latency_ms": 12.5}
+    assert dict(counters.items()) == {"cascade": {"small_requests": 2, "small_latency_ms": 12.5}}
+    assert counters.get("stream", {}) == {}
+
+
+def test_failed_flush_keeps_counters():
+    counters = CounterStore("metrics")
+    counters.increment("stream", "completed_streams")
+
+    def locked(key, amounts):
+        raise RuntimeError("database is locked")
+
+    counters.increment_many = locked
+    with pytest.raises(RuntimeError):
+        counters.flush()
+    del counters.increment_many
+
+    counters.increment("stream", "completed_streams")
+    counters.flush()
+    assert SharedStore("metrics").get("stream") == {"completed_streams": 2}
+    assert counters.pending == {}
@@ -0,0 +1,115 @@
+import asyncio
+from tenancy import FairScheduler, UsageAccounting
+
+
+def test_release_skips_waiter_cancelled_in_same_tick():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, weights={})
+        holder_release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("a", 1):
+                await holder_release.wait()
+
+        async def waiter():
+            async with scheduler.slot("b", 1):
+                pass
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert len(scheduler.queue) == 1
+
+        # The holder releases and the queued waiter is cancelled before
+        # either task gets to run again
+        holder_release.set()
+        queued.cancel()
+        results = await asyncio.gather(holding, queued, return_exceptions=True)
+
+        assert results[0] is None
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert scheduler.active == 0
+        assert scheduler.queue == []
+
+        # The slot is usable again
+        await asyncio.wait_for(waiter(), timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_slot_handed_to_next_live_waiter():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, weights={})
+        order = []
+        release = asyncio.Event()
+
+        async def use(tenant):
+            async with scheduler.slot(tenant, 1):
+                order.append(tenant)
+                if tenant == "a":
+                    await release.wait()
+
+        tasks = [asyncio.create_task(use(tenant)) for tenant in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        release.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert order == ["a", "c"]
+        assert scheduler.active == 0
+
+    asyncio.run(scenario())
+
+
+class FlakyStore:
+    def __init__(self, failures):
+        self.failures = failures
+        self.data = {}
+
+    def increment_many(self, key, amounts):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        value = self.data.setdefault(key, {})
+        for field, amount in amounts.items():
+            value[field] = value.get(field, 0) + amount
+        return value
+
+
+def test_failed_flush_keeps_counters_for_the_next_one():
+    store = FlakyStore(failures=1)
+    usage = UsageAccounting(store, budgets={}, flush_interval=0)
+    usage.record_tokens("a", 10, 5)
+    usage.record_tokens("b", 3, 1)
+
+    try:
+        usage.flush()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("flush should have raised")
+    usage.record_tokens("a", 1, 1)
+    usage.flush()
+
+    totals = {key.split(":", 1)[1]: value for key, value in store.data.items()}
+    assert totals == {
+        "a": {"requests": 2, "input_tokens": 11, "output_tokens": 6},
+        "b": {"requests": 1, "input_tokens": 3, "output_tokens": 1},
+    }
+    assert usage.pending == {}
+
+
+def test_flusher_survives_a_failed_flush():
+    async def scenario():
+        store = FlakyStore(failures=2)
+        usage = UsageAccounting(store, budgets={}, flush_interval=0)
+        usage.record_tokens("a", 10, 5)
+        flusher = asyncio.create_task(usage.run_flusher())
+        for _ in range(10):
+            await asyncio.sleep(0)
+        flusher.cancel()
+        return store
+
+    store = asyncio.run(scenario())
+    assert list(store.data.values()) == [{"requests": 1, "input_tokens": 10, "output_tokens": 5}]
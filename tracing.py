@@ -0,0 +1,351 @@
+# Request tracing with W3C traceparent propagation and head-based sampling.
+# The sampling decision is made once per trace when the request arrives (an
+# incoming traceparent's sampled flag wins), and unsampled requests only pay
+# for id generation. Finished traces are appended to a file as OTLP/JSON, one
+# export request per line, which the OpenTelemetry Collector's otlpjsonfile
+# receiver can ingest.
+import os
+import re
+import time
+import random
+import inspect
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from fastapi.routing import APIRoute
+from traffic_capture import CaptureLog
+
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "azure-openai-responses-api")
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+
+class Trace:
+    # The spans of one trace recorded by this process
+    def __init__(self, trace_id: str, sampled: bool, exporter: Optional["SpanExporter"]):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.exporter = exporter
+        self.spans: List["Span"] = []
+        self.root: Optional["Span"] = None
+        self.exported = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: Trace, parent_id: Optional[str], name: str, kind: int = SPAN_KIND_INTERNAL,
+                 start_ns: Optional[int] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def child(self, name: str, kind: int = SPAN_KIND_INTERNAL, start_ns: Optional[int] = None, **attributes: Any):
+        # Starts a span without making it current, for work that outlives a
+        # single context such as async generators
+        if not self.trace.sampled:
+            return NOOP_SPAN
+        return Span(self.trace, self.span_id, name, kind, start_ns, attributes)
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        trace = self.trace
+        trace.spans.append(self)
+        if trace.exporter is not None and (self is trace.root or trace.exported):
+            # The server span ends last; anything finishing after it is sent on its own
+            trace.exporter.export(trace.spans)
+            trace.spans = []
+            trace.exported = True
+
+
+class _NoopSpan:
+    # Stands in for spans of unsampled traces
+    traceparent = None
+    start_ns = None
+
+    def set(self, **attributes: Any):
+        pass
+
+    def child(self, name: str, kind: int = SPAN_KIND_INTERNAL, start_ns: Optional[int] = None, **attributes: Any):
+        return self
+
+    def end(self, end_ns: Optional[int] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any):
+    parent = _current.get()
+    if parent is None or not parent.trace.sampled:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.trace, parent.span_id, name, kind, attributes=attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+@contextmanager
+def activate(active_span):
+    # Makes a span started with child() current for a block that does not
+    # cross a yield
+    if not isinstance(active_span, Span):
+        yield active_span
+        return
+    token = _current.set(active_span)
+    try:
+        yield active_span
+    finally:
+        _current.reset(token)
+
+
+def record_span(name: str, start_ns: int, end_ns: Optional[int] = None, **attributes: Any):
+    # Adds an already finished span under the current one
+    current_span().child(name, start_ns=start_ns, **attributes).end(end_ns)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class SpanExporter:
+    def __init__(self, path: str):
+        self.log = CaptureLog(path)
+        self.resource = {"attributes": _otlp_attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})}
+
+    def export(self, spans: List[Span]):
+        if not spans:
+            return
+        otlp_spans = []
+        for item in spans:
+            otlp_span = {
+                "traceId": item.trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": item.kind,
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns),
+                "attributes": _otlp_attributes(item.attributes),
+                "status": {"code": 2, "message": item.error} if item.error else {}
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            otlp_spans.append(otlp_span)
+        self.log.append({"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}]
+        }]})
+
+
+class TracingMiddleware:
+    def __init__(self, app, path: str, sample_rate: float = 0.1):
+        self.app = app
+        self.exporter = SpanExporter(path)
+        self.sample_rate = sample_rate
+
+    def start_trace(self, scope) -> Span:
+        headers = dict(scope["headers"])
+        match = TRACEPARENT.match(headers.get(b"traceparent", b"").decode("latin-1").strip())
+        if match and match.group(1) != "0" * 32:
+            trace_id, parent_id = match.group(1), match.group(2)
+            sampled = int(match.group(3), 16) & 1 == 1
+        else:
+            trace_id, parent_id = "%032x" % random.getrandbits(128), None
+            sampled = random.random() < self.sample_rate
+        trace = Trace(trace_id, sampled, self.exporter if sampled else None)
+        root = Span(trace, parent_id, f"{scope['method']} {scope['path']}", SPAN_KIND_SERVER, attributes={
+            "http.request.method": scope["method"],
+            "url.path": scope["path"]
+        })
+        trace.root = root
+        return root
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root = self.start_trace(scope)
+        token = _current.set(root)
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                root.set(**{"http.response.status_code": message["status"]})
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"traceparent", root.traceparent.encode("latin-1"))
+                ]}
+            elif message["type"] == "http.response.body" and "response.first_byte_ms" not in root.attributes:
+                root.set(**{"response.first_byte_ms": round((time.time_ns() - root.start_ns) / 1e6, 2)})
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                root.name = f"{scope['method']} {route.path}"
+                root.set(**{"http.route": route.path})
+            root.end()
+
+
+# Route class that records request parsing (body read, JSON decode and
+# Pydantic validation) and the endpoint body as separate spans
+_parse_started: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("parse_started", default=None)
+
+
+def _traced_endpoint(endpoint):
+    def begin():
+        started = _parse_started.get()
+        if started is not None:
+            record_span("request.parse", started)
+        return span(f"handler {endpoint.__name__}")
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def traced(*args, **kwargs):
+            with begin():
+                return await endpoint(*args, **kwargs)
+    else:
+        @functools.wraps(endpoint)
+        def traced(*args, **kwargs):
+            with begin():
+                return endpoint(*args, **kwargs)
+    return traced
+
+
+class TracedRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _traced_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            _parse_started.set(time.time_ns())
+            return await handler(request)
+        return traced_handler
+
+
+# Upstream HTTP spans via httpx event hooks. The request hook injects the
+# traceparent header and starts a client span; httpcore's trace extension adds
+# connect, TLS and wait-for-headers child spans; the response hook ends the
+# span once response headers arrive.
+class _UpstreamTrace:
+    EVENTS = {
+        "connection.connect_tcp": "upstream.connect",
+        "connection.start_tls": "upstream.tls",
+        "http11.receive_response_headers": "upstream.wait_headers",
+        "http2.receive_response_headers": "upstream.wait_headers",
+    }
+
+    def __init__(self, client_span: Span):
+        self.span = client_span
+        self.started: Dict[str, int] = {}
+
+    def on_event(self, event_name: str):
+        prefix, _, phase = event_name.rpartition(".")
+        name = self.EVENTS.get(prefix)
+        if name is None:
+            return
+        if phase == "started":
+            self.started[prefix] = time.time_ns()
+        elif phase in ("complete", "failed") and prefix in self.started:
+            self.span.child(name, start_ns=self.started.pop(prefix), failed=phase == "failed").end()
+
+
+class _SyncUpstreamTrace(_UpstreamTrace):
+    def __call__(self, event_name: str, info: Dict[str, Any]):
+        self.on_event(event_name)
+
+
+class _AsyncUpstreamTrace(_UpstreamTrace):
+    async def __call__(self, event_name: str, info: Dict[str, Any]):
+        self.on_event(event_name)
+
+
+def _start_upstream_span(request, trace_class):
+    parent = _current.get()
+    if parent is None:
+        return
+    request.headers["traceparent"] = parent.traceparent
+    if not parent.trace.sampled:
+        return
+    client_span = parent.child(f"upstream {request.method} {request.url.path}", SPAN_KIND_CLIENT, **{
+        "http.request.method": request.method,
+        "server.address": request.url.host,
+        "url.path": request.url.path
+    })
+    request.headers["traceparent"] = client_span.traceparent
+    request.extensions["trace"] = trace_class(client_span)
+
+
+def _end_upstream_span(response):
+    trace = response.request.extensions.get("trace")
+    if isinstance(trace, _UpstreamTrace):
+        trace.span.set(**{"http.response.status_code": response.status_code})
+        trace.span.end()
+
+
+def sync_event_hooks() -> Dict[str, list]:
+    return {
+        "request": [lambda request: _start_upstream_span(request, _SyncUpstreamTrace)],
+        "response": [_end_upstream_span]
+    }
+
+
+def async_event_hooks() -> Dict[str, list]:
+    async def on_request(request):
+        _start_upstream_span(request, _AsyncUpstreamTrace)
+
+    async def on_response(response):
+        _end_upstream_span(response)
+
+    return {"request": [on_request], "response": [on_response]}
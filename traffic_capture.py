@@ -0,0 +1,130 @@
+# Opt-in traffic capture for load testing. Each request becomes one compact
+# JSON line: arrival time, route, redacted body, status, latency and the
+# timing/usage of every upstream call it made. Replay it with replay.py.
+import os
+import json
+import time
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+
+DEFAULT_REDACT_KEYS = "image,api_key,password,token,secret"
+DEFAULT_HEADERS = "x-request-timeout,x-tenant-id"
+MAX_CAPTURED_BODY = 1024 * 1024
+
+# Upstream calls made while handling the current request
+_upstream_calls: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "upstream_calls", default=None
+)
+
+
+def record_upstream(duration_ms: float, usage: Any = None, model: Optional[str] = None):
+    calls = _upstream_calls.get()
+    if calls is None:
+        return
+    entry: Dict[str, Any] = {"ms": round(duration_ms, 1)}
+    if model:
+        entry["m"] = model
+    if usage is not None:
+        entry["in"] = getattr(usage, "input_tokens", None)
+        entry["out"] = getattr(usage, "output_tokens", None)
+    calls.append(entry)
+
+
+def redact(value: Any, keys: set, all_text: bool, redacting: bool = False) -> Any:
+    # Masked strings keep their length so replayed requests keep their size
+    if isinstance(value, dict):
+        return {k: redact(v, keys, all_text, redacting or k.lower() in keys) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(item, keys, all_text, redacting) for item in value]
+    if isinstance(value, str) and (redacting or all_text):
+        return "x" * len(value)
+    return value
+
+
+class CaptureLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def append(self, record: Dict[str, Any]):
+        # One write per record; O_APPEND keeps lines from several workers whole
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self.lock:
+            os.write(self.fd, line)
+
+
+class TrafficCaptureMiddleware:
+    def __init__(self, app, path: str):
+        self.app = app
+        self.log = CaptureLog(path)
+        self.redact_keys = {
+            key.strip().lower()
+            for key in os.environ.get("TRAFFIC_CAPTURE_REDACT", DEFAULT_REDACT_KEYS).split(",")
+            if key.strip()
+        }
+        self.redact_all_text = os.environ.get("TRAFFIC_CAPTURE_REDACT_TEXT", "") == "1"
+        self.headers = {
+            header.strip().lower().encode("latin-1")
+            for header in os.environ.get("TRAFFIC_CAPTURE_HEADERS", DEFAULT_HEADERS).split(",")
+            if header.strip()
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        arrival = time.time()
+        started = time.perf_counter()
+        body = bytearray()
+        state: Dict[str, Any] = {"status": None, "ttfb": None}
+        calls: List[Dict[str, Any]] = []
+        token = _upstream_calls.set(calls)
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) < MAX_CAPTURED_BODY:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body" and state["ttfb"] is None:
+                state["ttfb"] = (time.perf_counter() - started) * 1000
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            _upstream_calls.reset(token)
+            self.log.append(self._record(scope, arrival, started, bytes(body), state, calls))
+
+    def _record(self, scope, arrival, started, body, state, calls) -> Dict[str, Any]:
+        record: Dict[str, Any] = {
+            "t": round(arrival, 4),
+            "m": scope["method"],
+            "r": scope["path"],
+            "s": state["status"] or 500,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        if state["ttfb"] is not None:
+            record["ttfb"] = round(state["ttfb"], 1)
+        if scope.get("query_string"):
+            record["q"] = scope["query_string"].decode("latin-1")
+        headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"] if name in self.headers
+        }
+        if headers:
+            record["h"] = headers
+        if body:
+            try:
+                record["b"] = redact(json.loads(body), self.redact_keys, self.redact_all_text)
+            except ValueError:
+                record["bl"] = len(body)
+        if calls:
+            record["u"] = calls
+        return record
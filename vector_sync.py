@@ -0,0 +1,140 @@
+# Incremental sync of a document directory into a vector store. A manifest of
+# (path, size, mtime, content hash, remote file id) is kept per directory so
+# only new or changed files are uploaded and deleted files are removed.
+import os
+import sys
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from openai import NotFoundError
+from shared_state import SharedStore
+
+manifests = SharedStore("vector_sync")
+
+
+def scan_directory(directory: str) -> Dict[str, Tuple[int, int]]:
+    # Relative path -> (size, mtime_ns) for every regular, non-hidden file
+    found = {}
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    found[os.path.relpath(entry.path, directory)] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sync_directory(client, directory: str, vector_store_id: Optional[str] = None,
+                   name: Optional[str] = None, max_concurrency: int = 8,
+                   batch_size: int = 100, expires_at: Optional[float] = None) -> Dict[str, Any]:
+    started = time.monotonic()
+    directory = os.path.abspath(directory)
+    manifest = manifests.get(directory) or {"vector_store_id": None, "files": {}}
+    if vector_store_id and vector_store_id != manifest["vector_store_id"]:
+        # A different store holds none of our files yet
+        manifest = {"vector_store_id": vector_store_id, "files": {}}
+    if not manifest["vector_store_id"]:
+        manifest["vector_store_id"] = client.vector_stores.create(
+            name=name or os.path.basename(directory)
+        ).id
+    store_id = manifest["vector_store_id"]
+    files = manifest["files"]
+
+    # Only files whose size or mtime changed are hashed
+    uploads: List[Tuple[str, str]] = []
+    stale_ids: List[str] = []
+    unchanged = 0
+    scanned = scan_directory(directory)
+    for path, (size, mtime_ns) in scanned.items():
+        entry = files.get(path)
+        if entry and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            unchanged += 1
+            continue
+        digest = hash_file(os.path.join(directory, path))
+        if entry and entry["sha256"] == digest:
+            entry.update(size=size, mtime_ns=mtime_ns)
+            unchanged += 1
+            continue
+        if entry:
+            stale_ids.append(entry["file_id"])
+        uploads.append((path, digest))
+
+    removed = [path for path in files if path not in scanned]
+    stale_ids.extend(files.pop(path)["file_id"] for path in removed)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        def delete_remote(file_id: str):
+            # Already gone if an earlier sync was interrupted after deleting it
+            try:
+                client.vector_stores.files.delete(file_id, vector_store_id=store_id)
+                client.files.delete(file_id)
+            except NotFoundError:
+                pass
+
+        def upload(path: str) -> str:
+            with open(os.path.join(directory, path), "rb") as file:
+                return client.files.create(file=file, purpose="assistants").id
+
+        list(pool.map(delete_remote, stale_ids))
+
+        for start in range(0, len(uploads), batch_size):
+            # Progress is saved per batch, so a sync past its deadline stops
+            # here and the next run picks up the remaining files
+            if expires_at is not None and time.monotonic() > expires_at:
+                raise TimeoutError("Request deadline exceeded")
+            batch = uploads[start:start + batch_size]
+            file_ids = list(pool.map(upload, [path for path, _ in batch]))
+            client.vector_stores.file_batches.create_and_poll(store_id, file_ids=file_ids)
+            for (path, digest), file_id in zip(batch, file_ids):
+                size, mtime_ns = scanned[path]
+                files[path] = {"size": size, "mtime_ns": mtime_ns, "sha256": digest, "file_id": file_id}
+            # Persist after every batch so an interrupted sync keeps its progress
+            manifests[directory] = manifest
+
+    manifests[directory] = manifest
+    return {
+        "vector_store_id": store_id,
+        "uploaded": len(uploads),
+        "removed": len(removed),
+        "unchanged": unchanged,
+        "elapsed_seconds": round(time.monotonic() - started, 3)
+    }
+
+
+if __name__ == "__main__":
+    from openai import AzureOpenAI
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Sync a document directory into an Azure OpenAI vector store")
+    parser.add_argument("directory")
+    parser.add_argument("--vector-store-id", help="Existing vector store to sync into")
+    parser.add_argument("--name", help="Name for a newly created vector store")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel uploads and deletes")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        sys.exit(f"Not a directory: {args.directory}")
+
+    client = AzureOpenAI(
+        api_key=os.environ["AZURE_OPENAI_API_KEY"],
+        api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+        azure_endpoint=os.environ["AZURE_OPENAI_API_ENDPOINT"]
+    )
+    print(sync_directory(client, args.directory, args.vector_store_id, args.name, args.concurrency))